@@ -0,0 +1,501 @@
+"""Content LEGO API 基准测试
+
+生成指定规模的合成数据，分别在进程内（ASGI）和通过 HTTP（uvicorn 子进程）驱动 API，
+统计每个接口的吞吐量和 p50/p99 延迟，以及启动耗时和内存占用。
+结果以 JSON 保存到 benchmark_results/，可与之前的运行结果对比。
+
+用法（在 backend 目录下执行，需要 httpx）：
+    python benchmark.py --bricks 10000
+    python benchmark.py --bricks 1000000 --mode http --requests 50
+    python benchmark.py --bricks 10000 --compare latest
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+try:
+    import httpx
+except ImportError:
+    sys.exit("基准测试需要 httpx：pip install httpx")
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmark_results")
+
+# 默认关闭限流，测的是接口本身的吞吐；--rate-limits 时保留服务端配置
+UNLIMITED_ENV = {"RATE_LIMIT_READ_RATE": "0", "RATE_LIMIT_WRITE_RATE": "0", "RATE_LIMIT_AI_RATE": "0"}
+
+# 写场景的请求规模
+ANALYTICS_BATCH_SIZE = 50
+MEDIA_UPLOAD_SIZE = 256 * 1024
+
+BRICK_TYPES = ["text", "image", "cta", "faq", "quote", "video"]
+WORDS = [
+    "内容", "模块", "创作", "营销", "品牌", "用户", "增长", "活动", "产品", "故事",
+    "content", "brick", "launch", "growth", "campaign", "story", "product", "guide",
+]
+
+# 生成合成数据
+
+def make_brick(index: int, rng: random.Random, now: str) -> Dict[str, Any]:
+    brick_type = BRICK_TYPES[index % len(BRICK_TYPES)]
+    body_words = rng.randint(20, 200)
+    brick = {
+        "id": f"bench-brick-{index}",
+        "type": brick_type,
+        "title": f"积木 {index}",
+        "content": " ".join(rng.choice(WORDS) for _ in range(body_words)),
+        "metadata": None,
+        "tags": rng.sample(WORDS, rng.randint(1, 4)),
+        "version": 1,
+        "createdAt": now,
+        "updatedAt": now,
+    }
+    if brick_type in ("image", "video", "cta"):
+        brick["metadata"] = {
+            "description": f"{brick_type} 积木 {index}",
+            "imageUrl": f"https://example.com/media/{index}.jpg",
+            "linkUrl": f"https://example.com/{index}",
+            "buttonText": "了解更多" if brick_type == "cta" else None,
+        }
+    return brick
+
+def seed_data(data_dir: str, bricks: int, templates: int, bricks_per_template: int,
+              compositions: int, seed: int) -> Dict[str, int]:
+    """按 main.py 的文件格式写入合成数据，返回各文件字节数"""
+    rng = random.Random(seed)
+    now = datetime.now().isoformat()
+    os.makedirs(data_dir, exist_ok=True)
+
+    bricks_data = {}
+    for i in range(bricks):
+        brick = make_brick(i, rng, now)
+        bricks_data[brick["id"]] = brick
+    brick_list = list(bricks_data.values())
+
+    def pick_bricks(count: int) -> List[Dict[str, Any]]:
+        if not brick_list:
+            return []
+        return [rng.choice(brick_list) for _ in range(count)]
+
+    templates_data = {}
+    for i in range(templates):
+        template_id = f"bench-template-{i}"
+        templates_data[template_id] = {
+            "id": template_id,
+            "name": f"模板 {i}",
+            "description": "基准测试模板",
+            "bricks": pick_bricks(bricks_per_template),
+            "category": rng.choice(["marketing", "social", "email", "blog"]),
+            "isPublic": i % 2 == 0,
+            "variables": [],
+            "tags": rng.sample(WORDS, 2),
+            "usageCount": 0,
+            "rating": 0.0,
+            "createdBy": "benchmark",
+            "createdAt": now,
+            "updatedAt": now,
+        }
+
+    compositions_data = {}
+    for i in range(compositions):
+        composition_id = f"bench-composition-{i}"
+        compositions_data[composition_id] = {
+            "id": composition_id,
+            "name": f"作品 {i}",
+            "description": None,
+            "bricks": pick_bricks(bricks_per_template),
+            "category": "default",
+            "tags": [],
+            "createdBy": "benchmark",
+            "createdAt": now,
+            "updatedAt": now,
+        }
+
+    sizes = {}
+    for name, data in (("bricks", bricks_data), ("templates", templates_data),
+                       ("compositions", compositions_data)):
+        path = os.path.join(data_dir, f"{name}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        sizes[name] = os.path.getsize(path)
+    return sizes
+
+# 统计
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # 最近秩法
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        "requests": count,
+        "errors": errors,
+        "throughput_rps": round(count / elapsed, 2) if elapsed > 0 else 0.0,
+        "mean_ms": round(sum(latencies) / count * 1000, 3) if count else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if count else 0.0,
+    }
+
+# 场景
+
+def build_scenarios(args, fixtures: Dict[str, List[str]]) -> List[tuple]:
+    """(名称, 方法, 路径生成函数, 请求参数生成函数, 请求数)；写接口每次都会整文件重写，默认请求更少"""
+    rng = random.Random(args.seed + 1)
+    brick_count = max(args.bricks, 1)
+    template_count = max(args.templates, 1)
+    composition_count = max(args.compositions, 1)
+
+    def brick_path():
+        return f"/bricks/bench-brick-{rng.randrange(brick_count)}"
+
+    def new_brick():
+        return {"json": {"type": "text", "title": "基准测试", "content": " ".join(rng.sample(WORDS, 8)), "tags": ["bench"]}}
+
+    def composition_patch():
+        return {"json": {"operations": [{"op": "update", "index": 0, "changes": {"title": f"标题 {rng.random()}"}}]}}
+
+    def event_batch():
+        now = datetime.now().isoformat()
+        return {"json": {"events": [
+            {"type": "brick_viewed", "entityId": f"bench-brick-{rng.randrange(brick_count)}", "timestamp": now}
+            for _ in range(ANALYTICS_BATCH_SIZE)
+        ]}}
+
+    def media_upload():
+        return {"files": {"file": ("bench.png", rng.randbytes(MEDIA_UPLOAD_SIZE), "image/png")}}
+
+    scenarios = [
+        ("GET /bricks", "GET", lambda: "/bricks", None, args.requests),
+        ("GET /bricks?type=", "GET", lambda: "/bricks?type=text", None, args.requests),
+        ("GET /bricks?search=", "GET", lambda: f"/bricks?search={rng.choice(WORDS)}", None, args.requests),
+        ("GET /bricks/{id}", "GET", brick_path, None, args.requests * 10),
+        ("GET /bricks/summaries", "GET", lambda: "/bricks/summaries", None, args.requests),
+        ("GET /bricks/facets", "GET", lambda: "/bricks/facets", None, args.requests),
+        ("GET /bricks/facets?search=", "GET", lambda: f"/bricks/facets?search={rng.choice(WORDS)}", None, args.requests),
+        ("GET /templates", "GET", lambda: "/templates", None, args.requests),
+        ("GET /templates/{id}", "GET",
+         lambda: f"/templates/bench-template-{rng.randrange(template_count)}", None, args.requests * 10),
+        ("GET /templates/facets", "GET", lambda: "/templates/facets", None, args.requests),
+        ("GET /compositions", "GET", lambda: "/compositions", None, args.requests),
+        ("GET /analytics/summary", "GET", lambda: f"/analytics/summary?window={rng.choice(['hour', 'day', 'week'])}",
+         None, args.requests),
+        ("GET /health", "GET", lambda: "/health", None, args.requests * 10),
+        ("POST /bricks", "POST", lambda: "/bricks", new_brick, args.write_requests),
+        ("PUT /bricks/{id}", "PUT", brick_path, lambda: {"json": {"title": "更新后的标题"}}, args.write_requests),
+        ("POST /analytics/events", "POST", lambda: "/analytics/events", event_batch, args.write_requests),
+        ("POST /media", "POST", lambda: "/media", media_upload, args.write_requests),
+    ]
+    # 依赖现有数据的场景：数据中没有对应对象时跳过
+    if fixtures["blob_hashes"]:
+        scenarios.append(("GET /blobs/{hash}", "GET", lambda: f"/blobs/{rng.choice(fixtures['blob_hashes'])}",
+                          None, args.requests * 10))
+    if fixtures["media_ids"]:
+        scenarios.append(("GET /media/{id}", "GET", lambda: f"/media/{rng.choice(fixtures['media_ids'])}",
+                          None, args.requests * 10))
+    if args.compositions > 0 and args.bricks_per_template > 0:
+        scenarios.append(("PATCH /compositions/{id}", "PATCH",
+                          lambda: f"/compositions/bench-composition-{rng.randrange(composition_count)}",
+                          composition_patch, args.write_requests))
+    if args.only:
+        scenarios = [s for s in scenarios if any(key in s[0] for key in args.only)]
+    return scenarios
+
+async def prepare_fixtures(client: httpx.AsyncClient) -> Dict[str, List[str]]:
+    """收集读取场景要用的正文哈希，并上传一个素材"""
+    summaries = await client.get("/bricks/summaries")
+    blob_hashes = [s["contentHash"] for s in summaries.json() if s.get("contentHash")] if summaries.status_code == 200 else []
+    media = await client.post("/media", files={"file": ("bench.png", os.urandom(MEDIA_UPLOAD_SIZE), "image/png")})
+    return {"blob_hashes": blob_hashes, "media_ids": [media.json()["id"]] if media.status_code == 200 else []}
+
+async def run_scenario(client: httpx.AsyncClient, scenario, concurrency: int) -> Dict[str, Any]:
+    name, method, make_path, make_request, total = scenario
+    latencies: List[float] = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            request_args = make_request() if make_request else {}
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, make_path(), **request_args)
+                await response.aread()
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, total)))))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+async def run_scenarios(client: httpx.AsyncClient, args) -> Dict[str, Any]:
+    results = {}
+    for scenario in build_scenarios(args, await prepare_fixtures(client)):
+        if scenario[4] <= 0:
+            continue
+        result = await run_scenario(client, scenario, args.concurrency)
+        results[scenario[0]] = result
+        print_result(scenario[0], result)
+    return results
+
+def print_result(name: str, result: Dict[str, Any]):
+    print(f"  {name:<28} {result['requests']:>7} req  {result['throughput_rps']:>10.1f} rps  "
+          f"p50 {result['p50_ms']:>9.2f} ms  p99 {result['p99_ms']:>9.2f} ms  errors {result['errors']}")
+
+# 启动耗时与内存
+
+def measure_startup(data_dir: str) -> Dict[str, Any]:
+    """在独立子进程中导入 main，测量加载数据的耗时和峰值内存"""
+    probe = (
+        "import json, resource, time\n"
+        "started = time.perf_counter()\n"
+        "import main\n"
+        "elapsed = time.perf_counter() - started\n"
+        "print(json.dumps({'startup_seconds': round(elapsed, 4),"
+        " 'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),"
+        " 'bricks_loaded': len(main.bricks_db)}))\n"
+    )
+    env = dict(os.environ, DATA_DIR=data_dir)
+    output = subprocess.run(
+        [sys.executable, "-c", probe], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def read_rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+# 运行模式
+
+async def run_inprocess(args) -> Dict[str, Any]:
+    print("\n[进程内 ASGI]")
+    os.environ["DATA_DIR"] = args.data_dir
+    if not args.rate_limits:
+        os.environ.update(UNLIMITED_ENV)
+    sys.path.insert(0, BACKEND_DIR)
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        endpoints = await run_scenarios(client, args)
+
+    # 直接测量持久化函数，排除 HTTP 栈的开销
+    flush_latencies = []
+    for _ in range(args.flush_iterations):
+        started = time.perf_counter()
+        main.save_bricks_to_file()
+        flush_latencies.append(time.perf_counter() - started)
+    flush = summarize(flush_latencies, 0, sum(flush_latencies))
+    print_result("save_bricks_to_file()", flush)
+
+    return {
+        "endpoints": endpoints,
+        "save_bricks_to_file": flush,
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def wait_until_ready(base_url: str, timeout: float):
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.perf_counter() < deadline:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("uvicorn 未能在超时时间内启动")
+
+async def run_http(args) -> Dict[str, Any]:
+    print("\n[HTTP / uvicorn]")
+    port = args.port or free_port()
+    env = dict(os.environ, DATA_DIR=args.data_dir)
+    if not args.rate_limits:
+        env.update(UNLIMITED_ENV)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        started = time.perf_counter()
+        await wait_until_ready(base_url, args.startup_timeout)
+        ready_seconds = round(time.perf_counter() - started, 4)
+        print(f"  服务就绪耗时 {ready_seconds}s")
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+            endpoints = await run_scenarios(client, args)
+        return {"endpoints": endpoints, "ready_seconds": ready_seconds, "server_rss_mb": read_rss_mb(server.pid)}
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+# 结果保存与对比
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save_results(results: Dict[str, Any], output_dir: str) -> str:
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    return path
+
+def find_baseline(compare: str, output_dir: str, exclude: str) -> Optional[str]:
+    if compare != "latest":
+        return compare
+    if not os.path.isdir(output_dir):
+        return None
+    candidates = sorted(
+        os.path.join(output_dir, name) for name in os.listdir(output_dir)
+        if name.startswith("benchmark-") and name.endswith(".json")
+    )
+    candidates = [path for path in candidates if os.path.abspath(path) != os.path.abspath(exclude)]
+    return candidates[-1] if candidates else None
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any]):
+    print(f"\n与 {baseline.get('timestamp')} ({baseline.get('git_revision')}) 对比：")
+    for mode in ("inprocess", "http"):
+        if mode not in current or mode not in baseline:
+            continue
+        print(f"[{mode}]")
+        for name, result in current[mode]["endpoints"].items():
+            before = baseline[mode]["endpoints"].get(name)
+            if not before:
+                continue
+            deltas = []
+            for key in ("throughput_rps", "p50_ms", "p99_ms"):
+                if before[key]:
+                    deltas.append(f"{key} {(result[key] - before[key]) / before[key] * 100:+.1f}%")
+            print(f"  {name:<28} " + "  ".join(deltas))
+    if current.get("startup") and baseline.get("startup"):
+        before = baseline["startup"]["startup_seconds"]
+        after = current["startup"]["startup_seconds"]
+        if before:
+            print(f"  startup_seconds {(after - before) / before * 100:+.1f}%")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Content LEGO API 基准测试")
+    parser.add_argument("--bricks", type=int, default=10000, help="合成积木数量")
+    parser.add_argument("--templates", type=int, default=100, help="合成模板数量")
+    parser.add_argument("--compositions", type=int, default=100, help="合成作品数量")
+    parser.add_argument("--bricks-per-template", type=int, default=50, help="每个模板/作品包含的积木数")
+    parser.add_argument("--requests", type=int, default=100, help="每个读接口的请求数（单条查询接口 x10）")
+    parser.add_argument("--write-requests", type=int, default=20, help="每个写接口的请求数")
+    parser.add_argument("--flush-iterations", type=int, default=5, help="直接调用 save_bricks_to_file 的次数")
+    parser.add_argument("--concurrency", type=int, default=10, help="并发请求数")
+    parser.add_argument("--mode", choices=["inprocess", "http", "both"], default="both")
+    parser.add_argument("--only", nargs="*", help="只运行名称包含这些关键字的场景")
+    parser.add_argument("--port", type=int, default=0, help="HTTP 模式端口，默认随机")
+    parser.add_argument("--timeout", type=float, default=120.0, help="HTTP 请求超时（秒）")
+    parser.add_argument("--startup-timeout", type=float, default=600.0, help="等待 uvicorn 就绪的超时（秒）")
+    parser.add_argument("--rate-limits", action="store_true", help="保留服务端限流配置（默认关闭限流）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", help="使用已有数据目录（不重新生成；只读取，迁移和压测都在其副本上进行）")
+    parser.add_argument("--output-dir", default=RESULTS_DIR)
+    parser.add_argument("--compare", help="对比的历史结果文件，或 latest 表示最近一次")
+    parser.add_argument("--no-save", action="store_true", help="不保存本次结果")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # 迁移和压测都在临时目录中进行，--data-dir 指定的目录只读取、不修改
+    temp_dir = tempfile.mkdtemp(prefix="contentlego-bench-")
+    source_dir, args.data_dir = args.data_dir, temp_dir
+    if source_dir:
+        shutil.copytree(source_dir, temp_dir, dirs_exist_ok=True)
+    else:
+        started = time.perf_counter()
+        sizes = seed_data(args.data_dir, args.bricks, args.templates, args.bricks_per_template,
+                          args.compositions, args.seed)
+        print(f"生成数据 {time.perf_counter() - started:.1f}s: "
+              + ", ".join(f"{name} {size / 1024 / 1024:.1f}MB" for name, size in sizes.items()))
+
+    results: Dict[str, Any] = {
+        "timestamp": datetime.now().isoformat(),
+        "git_revision": git_revision(),
+        "python": sys.version.split()[0],
+        "config": {key: value for key, value in vars(args).items() if key not in ("data_dir", "output_dir")},
+    }
+    try:
+        # 合成数据是正文内联的旧格式，首次导入会迁移到 blob 存储并重写集合文件，
+        # 先导入一次完成迁移，再测稳态启动耗时
+        first_load = measure_startup(args.data_dir)
+        results["startup"] = measure_startup(args.data_dir)
+        results["startup"]["first_load_seconds"] = first_load["startup_seconds"]
+        print(f"启动耗时 {results['startup']['startup_seconds']}s（首次加载含迁移 {first_load['startup_seconds']}s）, "
+              f"峰值内存 {results['startup']['max_rss_mb']}MB")
+        # 写接口会修改数据，每种模式各用一份数据副本，两种模式测的是同样的初始数据
+        seeded_dir = args.data_dir
+        for mode, run in (("http", run_http), ("inprocess", run_inprocess)):
+            if args.mode not in (mode, "both"):
+                continue
+            args.data_dir = tempfile.mkdtemp(prefix=f"contentlego-bench-{mode}-")
+            try:
+                shutil.copytree(seeded_dir, args.data_dir, dirs_exist_ok=True)
+                results[mode] = asyncio.run(run(args))
+            finally:
+                shutil.rmtree(args.data_dir, ignore_errors=True)
+                args.data_dir = seeded_dir
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    saved_path = ""
+    if not args.no_save:
+        saved_path = save_results(results, args.output_dir)
+        print(f"\n结果已保存到 {saved_path}")
+    if args.compare:
+        baseline_path = find_baseline(args.compare, args.output_dir, saved_path)
+        if baseline_path:
+            with open(baseline_path, encoding="utf-8") as f:
+                compare_results(results, json.load(f))
+        else:
+            print("\n没有可对比的历史结果")
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,52 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, File, HTTPException, Request, Response, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.routing import Match
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Set
 from datetime import datetime
+from array import array
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import anyio
+import contextvars
+import gzip
+import hashlib
+import heapq
+import random
+import sys
+import threading
+import time
 import uuid
 import json
+import math
+import mimetypes
 import os
+import struct
+import zlib
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，未安装时只提供 gzip
+    brotli = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 事件循环延迟监控（见文件末尾的监控部分）；保留任务引用，避免被垃圾回收
+    event_loop_monitor = asyncio.create_task(monitor_event_loop_lag())
+    try:
+        yield
+    finally:
+        event_loop_monitor.cancel()
 
 app = FastAPI(
     title="Content LEGO API",
     description="智能化 Brick 模块化创作平台 API",
-    version="1.0.0"
-)
-
-# CORS 配置
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # 允许所有来源，生产环境应该配置具体域名
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # 数据模型
@@ -40,6 +67,20 @@ class ContentBrick(BaseModel):
     createdAt: str
     updatedAt: str
 
+class BrickSummary(BaseModel):
+    """不含大正文的积木：小正文直接放在 content 中，其余通过 GET /blobs/{contentHash} 按需获取"""
+    id: str
+    type: str
+    title: str
+    content: Optional[str] = None
+    contentHash: Optional[str] = None
+    contentLength: int
+    metadata: Optional[BrickMetadata] = None
+    tags: List[str]
+    version: int
+    createdAt: str
+    updatedAt: str
+
 class CreateBrickRequest(BaseModel):
     type: str
     title: str
@@ -53,6 +94,13 @@ class UpdateBrickRequest(BaseModel):
     metadata: Optional[BrickMetadata] = None
     tags: Optional[List[str]] = None
 
+class TemplateVariable(BaseModel):
+    name: str
+    type: str  # 'text' | 'image' | 'link' | 'date'
+    required: bool
+    defaultValue: Optional[str] = None
+    description: str
+
 class ContentTemplate(BaseModel):
     id: str
     name: str
@@ -68,13 +116,6 @@ class ContentTemplate(BaseModel):
     createdAt: str
     updatedAt: str
 
-class TemplateVariable(BaseModel):
-    name: str
-    type: str  # 'text' | 'image' | 'link' | 'date'
-    required: bool
-    defaultValue: Optional[str] = None
-    description: str
-
 class CreateTemplateRequest(BaseModel):
     name: str
     description: str
@@ -135,6 +176,18 @@ class CreateCompositionRequest(BaseModel):
     category: str = "default"
     tags: List[str] = []
 
+class CompositionOperation(BaseModel):
+    op: str  # 'insert' | 'move' | 'update' | 'remove'
+    brickId: Optional[str] = None
+    index: Optional[int] = None
+    toIndex: Optional[int] = None
+    brick: Optional[ContentBrick] = None
+    changes: Optional[UpdateBrickRequest] = None
+
+class PatchCompositionRequest(BaseModel):
+    operations: List[CompositionOperation]
+    clientId: Optional[str] = None
+
 class PublishingChannel(BaseModel):
     id: str
     name: str
@@ -152,6 +205,22 @@ class PublishingChannel(BaseModel):
     createdAt: str
     updatedAt: str
 
+class MediaAsset(BaseModel):
+    id: str  # 文件内容的 sha256
+    filename: str
+    contentType: str
+    size: int
+    url: str
+    createdAt: str
+
+class AnalyticsEvent(BaseModel):
+    type: str  # 'brick_viewed' | 'template_used' | 'composition_published'
+    entityId: str
+    timestamp: Optional[str] = None  # ISO 时间，缺省为服务器接收时间
+
+class AnalyticsEventBatch(BaseModel):
+    events: List[AnalyticsEvent]
+
 class CreateChannelRequest(BaseModel):
     name: str
     type: str = "custom"
@@ -170,100 +239,644 @@ class UpdateChannelRequest(BaseModel):
     status: Optional[str] = None
 
 # 数据文件路径
-DATA_DIR = "data"
+DATA_DIR = os.environ.get("DATA_DIR", "data")
 BRICKS_FILE = os.path.join(DATA_DIR, "bricks.json")
 TEMPLATES_FILE = os.path.join(DATA_DIR, "templates.json")
 COMPOSITIONS_FILE = os.path.join(DATA_DIR, "compositions.json")
 CHANNELS_FILE = os.path.join(DATA_DIR, "channels.json")
+MEDIA_FILE = os.path.join(DATA_DIR, "media.json")
+MEDIA_DIR = os.path.join(DATA_DIR, "media")
 
 # 确保数据目录存在
 os.makedirs(DATA_DIR, exist_ok=True)
+os.makedirs(MEDIA_DIR, exist_ok=True)
 
 # 内存数据库
 bricks_db: Dict[str, ContentBrick] = {}
 templates_db: Dict[str, ContentTemplate] = {}
 compositions_db: Dict[str, ContentComposition] = {}
 channels_db: Dict[str, PublishingChannel] = {}
+media_db: Dict[str, MediaAsset] = {}
+
+# 监控指标（Prometheus 文本格式，由 /metrics 输出）
+def _format_labels(labelnames, labelvalues, extra=None) -> str:
+    pairs = list(zip(labelnames, labelvalues)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = [
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    ]
+    return "{" + ",".join(escaped) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *labelvalues, amount: float = 1.0):
+        self.values[labelvalues] = self.values.get(labelvalues, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labelvalues, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+class Gauge:
+    """瞬时值；传入 collect 时在输出前现取，返回数值或 {标签元组: 数值}"""
+
+    def __init__(self, name: str, help_text: str, labelnames=(), collect=None):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[tuple, float] = {}
+        self.collect = collect
+
+    def set(self, value: float, *labelvalues):
+        self.values[labelvalues] = value
+
+    def inc(self, *labelvalues, amount: float = 1.0):
+        self.values[labelvalues] = self.values.get(labelvalues, 0.0) + amount
+
+    def dec(self, *labelvalues, amount: float = 1.0):
+        self.inc(*labelvalues, amount=-amount)
+
+    def render(self) -> List[str]:
+        values = self.values
+        if self.collect is not None:
+            collected = self.collect()
+            values = collected if isinstance(collected, dict) else {(): collected}
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for labelvalues, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    """累积分桶直方图，桶边界单位与观测值一致"""
+
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # 标签 -> [各桶计数, 总和, 总数]
+        self.series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labelvalues):
+        series = self.series.get(labelvalues)
+        if series is None:
+            series = self.series[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labelvalues, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP 请求数", ("method", "route", "status"))
+HTTP_ERRORS = Counter("http_request_errors_total", "状态码 >= 500 或抛出异常的 HTTP 请求数", ("method", "route"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP 请求处理耗时", ("method", "route"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "正在处理的 HTTP 请求数")
+PERSISTENCE_FLUSH_DURATION = Histogram("persistence_flush_duration_seconds", "集合写盘耗时", ("collection",))
+PERSISTENCE_BYTES_WRITTEN = Counter("persistence_bytes_written_total", "集合写盘字节数", ("collection",))
+PERSISTENCE_ERRORS = Counter("persistence_errors_total", "持久化失败次数", ("collection", "operation"))
+COLLECTION_LOAD_SECONDS = Gauge("collection_load_duration_seconds", "最近一次从文件加载集合的耗时", ("collection",))
+CACHE_LOOKUPS = Counter("cache_lookups_total", "缓存查询次数，命中率 = hit / (hit + miss)", ("cache", "result"))
+COLLECTION_RECORDS = Gauge(
+    "collection_records", "集合当前记录数", ("collection",),
+    collect=lambda: {
+        ("bricks",): len(bricks_db),
+        ("templates",): len(templates_db),
+        ("compositions",): len(compositions_db),
+        ("channels",): len(channels_db),
+        ("media",): len(media_db),
+    },
+)
+RESPONSE_COMPRESSION_BYTES = Counter(
+    "response_compression_bytes_total", "响应压缩前(in)后(out)字节数", ("encoding", "direction"),
+)
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "事件循环调度延迟",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+METRICS: List[Any] = [
+    HTTP_REQUESTS, HTTP_ERRORS, HTTP_LATENCY, HTTP_IN_FLIGHT,
+    PERSISTENCE_FLUSH_DURATION, PERSISTENCE_BYTES_WRITTEN, PERSISTENCE_ERRORS,
+    COLLECTION_LOAD_SECONDS, COLLECTION_RECORDS, CACHE_LOOKUPS, RESPONSE_COMPRESSION_BYTES, EVENT_LOOP_LAG,
+]
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# 请求性能剖析
+# 按 PROFILE_SAMPLE_RATE 抽样，或请求带 X-Debug-Profile 头时（需设置 PROFILE_ALLOW_HEADER=1），
+# 对该请求期间的事件循环线程做栈采样，同时记录 profile_section 标注的阶段耗时，结果可从 /admin/profiles 取回。
+# 采样的是所有请求共用的事件循环线程：剖析期间并发处理的其他请求的栈也会记到这次剖析上，
+# 详情里的 maxInFlight 大于 1 时火焰图和阶段采样并不只属于该请求，需在低并发下剖析才准确
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0.0))
+PROFILE_HEADER = "X-Debug-Profile"
+# 默认关闭：任何客户端都能带这个头，开启后每个请求都会启动采样线程并缩短线程切换间隔
+PROFILE_ALLOW_HEADER = os.environ.get("PROFILE_ALLOW_HEADER", "").lower() in ("1", "true", "yes")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.001))
+PROFILE_HISTORY = int(os.environ.get("PROFILE_HISTORY", 50))
+PROFILE_MAX_DEPTH = 128
+
+# 栈中出现这些框架函数（模块:函数名）时，采样归入对应阶段
+PROFILE_FRAME_PHASES = {
+    "fastapi.routing:serialize_response": "serialization",
+    "fastapi.encoders:jsonable_encoder": "serialization",
+    "starlette.responses:render": "serialization",
+    "fastapi.responses:render": "serialization",
+    "fastapi.dependencies.utils:request_body_to_args": "validation",
+    "fastapi.dependencies.utils:solve_dependencies": "validation",
+    "fastapi.dependencies.utils:request_params_to_args": "validation",
+}
+# 栈顶是这些函数时事件循环线程正在等待 I/O（uvloop 的等待在 C 代码中，栈顶停在 asyncio.run），
+# 这类采样只计数，不计入火焰图和阶段
+PROFILE_IDLE_FRAMES = {"selectors:select", "asyncio.runners:run"}
+
+# 采样线程需要拿到 GIL 才能采样，剖析期间临时缩短线程切换间隔（默认 5ms）
+_switch_interval_lock = threading.Lock()
+_switch_interval_users = 0
+_default_switch_interval = sys.getswitchinterval()
+
+def _acquire_switch_interval():
+    global _switch_interval_users
+    with _switch_interval_lock:
+        _switch_interval_users += 1
+        if _switch_interval_users == 1:
+            sys.setswitchinterval(min(_default_switch_interval, PROFILE_INTERVAL))
+
+def _release_switch_interval():
+    global _switch_interval_users
+    with _switch_interval_lock:
+        _switch_interval_users -= 1
+        if _switch_interval_users == 0:
+            sys.setswitchinterval(_default_switch_interval)
+
+class RequestProfile:
+    """单个请求的剖析结果：折叠栈采样计数 + 阶段耗时"""
+
+    def __init__(self, method: str, path: str, thread_id: int, trigger: str):
+        self.id = str(uuid.uuid4())
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.status: Optional[int] = None
+        self.trigger = trigger
+        self.thread_id = thread_id
+        self.startedAt = datetime.now().isoformat()
+        self.duration = 0.0
+        self.stacks: Dict[str, int] = {}
+        self.phase_samples: Dict[str, int] = {}
+        self.section_seconds: Dict[str, float] = {}
+        self.current_section: Optional[str] = None
+        # 采样期间观察到的最大在途请求数（含本请求）
+        self.max_in_flight = 0
+        self.idle_samples = 0
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def start(self):
+        _acquire_switch_interval()
+        self._sampler = threading.Thread(target=self._sample_loop, name=f"profiler-{self.id[:8]}", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        _release_switch_interval()
+
+    def _sample_loop(self):
+        while not self._stop.wait(PROFILE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self._record_sample(frame)
+
+    def _record_sample(self, frame):
+        self.max_in_flight = max(self.max_in_flight, int(HTTP_IN_FLIGHT.values.get((), 0)))
+        names = []
+        phase = None
+        while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+            name = f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+            if not names and name in PROFILE_IDLE_FRAMES:
+                self.idle_samples += 1
+                return
+            if phase is None:
+                phase = PROFILE_FRAME_PHASES.get(name)
+            names.append(name.replace(";", ":").replace(" ", "_"))
+            frame = frame.f_back
+        stack = ";".join(reversed(names))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        # 手动标注的阶段优先于按框架函数推断
+        phase = self.current_section or phase or "handler"
+        self.phase_samples[phase] = self.phase_samples.get(phase, 0) + 1
+
+    def collapsed(self) -> str:
+        """flamegraph.pl / speedscope 可直接读取的折叠栈格式"""
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "trigger": self.trigger,
+            "startedAt": self.startedAt,
+            "durationMs": round(self.duration * 1000, 3),
+            "samples": sum(self.stacks.values()),
+        }
+
+    def detail(self) -> Dict[str, Any]:
+        return {
+            **self.summary(),
+            "sampleIntervalMs": PROFILE_INTERVAL * 1000,
+            "maxInFlight": self.max_in_flight,
+            "idleSamples": self.idle_samples,
+            "phaseSamples": self.phase_samples,
+            "sectionMs": {name: round(seconds * 1000, 3) for name, seconds in self.section_seconds.items()},
+        }
+
+_active_profile: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar("active_profile", default=None)
+profiles: "deque[RequestProfile]" = deque(maxlen=PROFILE_HISTORY)
+
+@contextmanager
+def profile_section(name: str):
+    """标注请求内的阶段（filtering / serialization / file_io 等），未开启剖析时几乎无开销"""
+    profile = _active_profile.get()
+    if profile is None:
+        yield
+        return
+    previous = profile.current_section
+    profile.current_section = name
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.section_seconds[name] = profile.section_seconds.get(name, 0.0) + time.perf_counter() - started
+        profile.current_section = previous
+
+# 积木正文的内容寻址存储
+# 正文按 sha256 存放在 data/blobs/ 下并用 zlib 压缩，集合文件中只保留 contentHash，
+# 相同正文（包括模板、作品里嵌入的积木）只存一份；引用计数按集合维护，归零后删除文件。
+# 小于 BLOB_INLINE_MAX_BYTES 的正文仍内联在集合文件中：单独成文件时 inode、磁盘块和
+# 打开读取的开销都比去重省下的空间大
+BLOBS_DIR = os.path.join(DATA_DIR, "blobs")
+BLOB_CACHE_BYTES = int(os.environ.get("BLOB_CACHE_BYTES", 64 * 1024 * 1024))
+BLOB_INLINE_MAX_BYTES = int(os.environ.get("BLOB_INLINE_MAX_BYTES", 1024))
+BLOB_COMPRESSION_LEVEL = 6
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def is_inline_content(content: str) -> bool:
+    """按 UTF-8 字节数判断；字符数已达到阈值时不必再编码"""
+    return len(content) < BLOB_INLINE_MAX_BYTES and len(content.encode("utf-8")) < BLOB_INLINE_MAX_BYTES
+
+class BlobStore:
+    """哈希寻址的压缩正文存储，带按字节数限制的 LRU 读缓存"""
+
+    def __init__(self, root: str, cache_bytes: int):
+        self.root = root
+        self.cache_bytes = cache_bytes
+        self.cache: "OrderedDict[str, str]" = OrderedDict()
+        # 哈希 -> 正文的 UTF-8 字节数；按字符数统计时中文正文会少算约 3 倍
+        self.cache_sizes: Dict[str, int] = {}
+        self.cached_bytes = 0
+        # 集合 -> {哈希: 引用次数}
+        self.refs: Dict[str, Dict[str, int]] = {}
+        # 集合 -> {正文: 哈希}，保存时未变化的正文不必重新计算哈希
+        self.memos: Dict[str, Dict[str, str]] = {}
+        # 所有集合都加载成功后才允许删除正文：某个集合加载失败时它的引用不在 refs 里，
+        # 其他集合保存时会把它引用的正文当成孤儿删掉
+        self.deletion_enabled = False
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, blob_hash: str) -> str:
+        return os.path.join(self.root, blob_hash[:2], blob_hash[2:])
+
+    def exists(self, blob_hash: str) -> bool:
+        return os.path.exists(self.path(blob_hash))
+
+    def write(self, blob_hash: str, content: str):
+        path = self.path(blob_hash)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = zlib.compress(content.encode("utf-8"), BLOB_COMPRESSION_LEVEL)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        PERSISTENCE_BYTES_WRITTEN.inc("blobs", amount=len(data))
+
+    def read(self, blob_hash: str, use_cache: bool = True) -> str:
+        if use_cache:
+            content = self.cache.get(blob_hash)
+            if content is not None:
+                self.cache.move_to_end(blob_hash)
+                CACHE_LOOKUPS.inc("blobs", "hit")
+                return content
+            CACHE_LOOKUPS.inc("blobs", "miss")
+        with open(self.path(blob_hash), "rb") as f:
+            raw = zlib.decompress(f.read())
+        content = raw.decode("utf-8")
+        if use_cache:
+            self._cache_put(blob_hash, content, len(raw))
+        return content
+
+    def _cache_put(self, blob_hash: str, content: str, size: int):
+        if size > self.cache_bytes:
+            return
+        self.cache[blob_hash] = content
+        self.cache_sizes[blob_hash] = size
+        self.cached_bytes += size
+        while self.cached_bytes > self.cache_bytes:
+            evicted, _ = self.cache.popitem(last=False)
+            self.cached_bytes -= self.cache_sizes.pop(evicted)
+
+    def refcount(self, blob_hash: str) -> int:
+        return sum(refs.get(blob_hash, 0) for refs in self.refs.values())
+
+    def hash_of(self, content: str) -> str:
+        for memo in self.memos.values():
+            blob_hash = memo.get(content)
+            if blob_hash is not None:
+                return blob_hash
+        return content_hash(content)
+
+    def _delete(self, blob_hash: str):
+        try:
+            os.remove(self.path(blob_hash))
+        except FileNotFoundError:
+            pass
+        if self.cache.pop(blob_hash, None) is not None:
+            self.cached_bytes -= self.cache_sizes.pop(blob_hash)
+
+    def replace_refs(self, collection: str, refs: Dict[str, int], memo: Dict[str, str]):
+        """集合文件写盘成功后调用：更新引用，删除不再被任何集合引用的正文"""
+        old_refs = self.refs.get(collection, {})
+        self.refs[collection] = refs
+        self.memos[collection] = memo
+        if not self.deletion_enabled:
+            return
+        for blob_hash in old_refs:
+            if blob_hash not in refs and self.refcount(blob_hash) == 0:
+                self._delete(blob_hash)
+
+    def collect_garbage(self) -> int:
+        """删除未被引用的正文文件（例如写盘中途进程退出留下的），返回删除数量"""
+        removed = 0
+        for prefix in os.listdir(self.root):
+            directory = os.path.join(self.root, prefix)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if name.endswith(".tmp") or self.refcount(prefix + name) == 0:
+                    os.remove(os.path.join(directory, name))
+                    removed += 1
+        return removed
+
+    def writer(self, collection: str) -> "BlobCollectionWriter":
+        return BlobCollectionWriter(self, collection)
+
+    def reader(self, collection: str) -> "BlobCollectionReader":
+        return BlobCollectionReader(self, collection)
+
+class BlobCollectionWriter:
+    """保存集合时把较大的积木正文替换为 contentHash，并统计本次的引用"""
+
+    def __init__(self, store: BlobStore, collection: str):
+        self.store = store
+        self.collection = collection
+        self.previous_memo = store.memos.get(collection, {})
+        self.memo: Dict[str, str] = {}
+        self.refs: Dict[str, int] = {}
+
+    def externalize_brick(self, brick_dict: Dict[str, Any]) -> Dict[str, Any]:
+        content = brick_dict["content"]
+        blob_hash = self.memo.get(content) or self.previous_memo.get(content)
+        if blob_hash is None:
+            if is_inline_content(content):
+                return brick_dict
+            blob_hash = content_hash(content)
+            self.store.write(blob_hash, content)
+        self.memo[content] = blob_hash
+        self.refs[blob_hash] = self.refs.get(blob_hash, 0) + 1
+        del brick_dict["content"]
+        brick_dict["contentHash"] = blob_hash
+        return brick_dict
+
+    def externalize_record(self, record_dict: Dict[str, Any]) -> Dict[str, Any]:
+        """模板、作品：处理其中嵌入的积木"""
+        record_dict["bricks"] = [self.externalize_brick(brick) for brick in record_dict["bricks"]]
+        return record_dict
+
+    def commit(self):
+        self.store.replace_refs(self.collection, self.refs, self.memo)
+
+class BlobCollectionReader:
+    """加载集合时按 contentHash 取回正文；内联正文原样保留，超过阈值的（旧格式）标记需要迁移"""
+
+    def __init__(self, store: BlobStore, collection: str):
+        self.store = store
+        self.collection = collection
+        self.memo: Dict[str, str] = {}
+        self.refs: Dict[str, int] = {}
+        self.contents: Dict[str, str] = {}
+        self.inline_found = False
+
+    def internalize_brick(self, brick_dict: Dict[str, Any]) -> Dict[str, Any]:
+        blob_hash = brick_dict.pop("contentHash", None)
+        if blob_hash is None:
+            if not is_inline_content(brick_dict.get("content", "")):
+                self.inline_found = True
+            return brick_dict
+        # 重复正文只读一次，并复用同一个字符串对象；启动时不经过缓存，避免把缓存挤满
+        content = self.contents.get(blob_hash)
+        if content is None:
+            content = self.contents[blob_hash] = self.store.read(blob_hash, use_cache=False)
+        brick_dict["content"] = content
+        self.memo[content] = blob_hash
+        self.refs[blob_hash] = self.refs.get(blob_hash, 0) + 1
+        return brick_dict
+
+    def internalize_record(self, record_dict: Dict[str, Any]) -> Dict[str, Any]:
+        record_dict["bricks"] = [self.internalize_brick(brick) for brick in record_dict.get("bricks", [])]
+        return record_dict
+
+    def commit(self):
+        self.store.refs[self.collection] = self.refs
+        self.store.memos[self.collection] = self.memo
+
+blob_store = BlobStore(BLOBS_DIR, BLOB_CACHE_BYTES)
 
 # 数据持久化函数
 def save_bricks_to_file():
     """保存bricks数据到文件"""
+    started = time.perf_counter()
     try:
-        with open(BRICKS_FILE, 'w', encoding='utf-8') as f:
-            # 将ContentBrick对象转换为字典
-            bricks_data = {brick_id: brick.model_dump() for brick_id, brick in bricks_db.items()}
-            json.dump(bricks_data, f, ensure_ascii=False, indent=2)
+        blobs = blob_store.writer("bricks")
+        with profile_section("serialization"):
+            # 将ContentBrick对象转换为字典，正文写入 blob 存储
+            bricks_data = {brick_id: blobs.externalize_brick(brick.model_dump()) for brick_id, brick in bricks_db.items()}
+            payload = json.dumps(bricks_data, ensure_ascii=False, indent=2).encode('utf-8')
+        with profile_section("file_io"), open(BRICKS_FILE, 'wb') as f:
+            f.write(payload)
+        blobs.commit()
+        PERSISTENCE_FLUSH_DURATION.observe(time.perf_counter() - started, "bricks")
+        PERSISTENCE_BYTES_WRITTEN.inc("bricks", amount=len(payload))
     except Exception as e:
+        PERSISTENCE_ERRORS.inc("bricks", "save")
         print(f"保存bricks数据失败: {e}")
 
 def load_bricks_from_file():
     """从文件加载bricks数据"""
+    started = time.perf_counter()
     try:
         if os.path.exists(BRICKS_FILE):
             with open(BRICKS_FILE, 'r', encoding='utf-8') as f:
                 bricks_data = json.load(f)
+                blobs = blob_store.reader("bricks")
                 # 将字典转换为ContentBrick对象
                 for brick_id, brick_dict in bricks_data.items():
-                    bricks_db[brick_id] = ContentBrick(**brick_dict)
+                    bricks_db[brick_id] = ContentBrick(**blobs.internalize_brick(brick_dict))
+                blobs.commit()
+            # 旧格式的正文内联在集合文件里，加载后立即迁移到 blob 存储
+            if blobs.inline_found:
+                save_bricks_to_file()
+        COLLECTION_LOAD_SECONDS.set(time.perf_counter() - started, "bricks")
     except Exception as e:
+        PERSISTENCE_ERRORS.inc("bricks", "load")
         print(f"加载bricks数据失败: {e}")
 
 def save_templates_to_file():
     """保存templates数据到文件"""
+    started = time.perf_counter()
     try:
-        with open(TEMPLATES_FILE, 'w', encoding='utf-8') as f:
-            # 将ContentTemplate对象转换为字典
-            templates_data = {template_id: template.model_dump() for template_id, template in templates_db.items()}
-            json.dump(templates_data, f, ensure_ascii=False, indent=2)
+        blobs = blob_store.writer("templates")
+        with profile_section("serialization"):
+            # 将ContentTemplate对象转换为字典，正文写入 blob 存储
+            templates_data = {template_id: blobs.externalize_record(template.model_dump()) for template_id, template in templates_db.items()}
+            payload = json.dumps(templates_data, ensure_ascii=False, indent=2).encode('utf-8')
+        with profile_section("file_io"), open(TEMPLATES_FILE, 'wb') as f:
+            f.write(payload)
+        blobs.commit()
+        PERSISTENCE_FLUSH_DURATION.observe(time.perf_counter() - started, "templates")
+        PERSISTENCE_BYTES_WRITTEN.inc("templates", amount=len(payload))
     except Exception as e:
+        PERSISTENCE_ERRORS.inc("templates", "save")
         print(f"保存templates数据失败: {e}")
 
 def load_templates_from_file():
     """从文件加载templates数据"""
+    started = time.perf_counter()
     try:
         if os.path.exists(TEMPLATES_FILE):
             with open(TEMPLATES_FILE, 'r', encoding='utf-8') as f:
                 templates_data = json.load(f)
+                blobs = blob_store.reader("templates")
                 # 将字典转换为ContentTemplate对象
                 for template_id, template_dict in templates_data.items():
-                    templates_db[template_id] = ContentTemplate(**template_dict)
+                    templates_db[template_id] = ContentTemplate(**blobs.internalize_record(template_dict))
+                blobs.commit()
+            # 旧格式的正文内联在集合文件里，加载后立即迁移到 blob 存储
+            if blobs.inline_found:
+                save_templates_to_file()
+        COLLECTION_LOAD_SECONDS.set(time.perf_counter() - started, "templates")
     except Exception as e:
+        PERSISTENCE_ERRORS.inc("templates", "load")
         print(f"加载templates数据失败: {e}")
 
 def save_compositions_to_file():
     """保存compositions数据到文件"""
+    started = time.perf_counter()
     try:
-        with open(COMPOSITIONS_FILE, 'w', encoding='utf-8') as f:
-            # 将ContentComposition对象转换为字典
-            compositions_data = {composition_id: composition.model_dump() for composition_id, composition in compositions_db.items()}
-            json.dump(compositions_data, f, ensure_ascii=False, indent=2)
+        blobs = blob_store.writer("compositions")
+        with profile_section("serialization"):
+            # 将ContentComposition对象转换为字典，正文写入 blob 存储
+            compositions_data = {composition_id: blobs.externalize_record(composition.model_dump()) for composition_id, composition in compositions_db.items()}
+            payload = json.dumps(compositions_data, ensure_ascii=False, indent=2).encode('utf-8')
+        with profile_section("file_io"), open(COMPOSITIONS_FILE, 'wb') as f:
+            f.write(payload)
+        blobs.commit()
+        PERSISTENCE_FLUSH_DURATION.observe(time.perf_counter() - started, "compositions")
+        PERSISTENCE_BYTES_WRITTEN.inc("compositions", amount=len(payload))
     except Exception as e:
+        PERSISTENCE_ERRORS.inc("compositions", "save")
         print(f"保存compositions数据失败: {e}")
 
 def load_compositions_from_file():
     """从文件加载compositions数据"""
+    started = time.perf_counter()
     try:
         if os.path.exists(COMPOSITIONS_FILE):
             with open(COMPOSITIONS_FILE, 'r', encoding='utf-8') as f:
                 compositions_data = json.load(f)
+                blobs = blob_store.reader("compositions")
                 # 将字典转换为ContentComposition对象
                 for composition_id, composition_dict in compositions_data.items():
-                    compositions_db[composition_id] = ContentComposition(**composition_dict)
+                    compositions_db[composition_id] = ContentComposition(**blobs.internalize_record(composition_dict))
+                blobs.commit()
+            # 旧格式的正文内联在集合文件里，加载后立即迁移到 blob 存储
+            if blobs.inline_found:
+                save_compositions_to_file()
+        COLLECTION_LOAD_SECONDS.set(time.perf_counter() - started, "compositions")
     except Exception as e:
+        PERSISTENCE_ERRORS.inc("compositions", "load")
         print(f"加载compositions数据失败: {e}")
 
 def save_channels_to_file():
     """保存channels数据到文件"""
+    started = time.perf_counter()
     try:
-        with open(CHANNELS_FILE, 'w', encoding='utf-8') as f:
+        with profile_section("serialization"):
             # 将PublishingChannel对象转换为字典
             channels_data = {channel_id: channel.model_dump() for channel_id, channel in channels_db.items()}
-            json.dump(channels_data, f, ensure_ascii=False, indent=2)
+            payload = json.dumps(channels_data, ensure_ascii=False, indent=2).encode('utf-8')
+        with profile_section("file_io"), open(CHANNELS_FILE, 'wb') as f:
+            f.write(payload)
+        PERSISTENCE_FLUSH_DURATION.observe(time.perf_counter() - started, "channels")
+        PERSISTENCE_BYTES_WRITTEN.inc("channels", amount=len(payload))
     except Exception as e:
+        PERSISTENCE_ERRORS.inc("channels", "save")
         print(f"保存channels数据失败: {e}")
 
 def load_channels_from_file():
     """从文件加载channels数据"""
+    started = time.perf_counter()
     try:
         if os.path.exists(CHANNELS_FILE):
             with open(CHANNELS_FILE, 'r', encoding='utf-8') as f:
@@ -271,15 +884,44 @@ def load_channels_from_file():
                 # 将字典转换为PublishingChannel对象
                 for channel_id, channel_dict in channels_data.items():
                     channels_db[channel_id] = PublishingChannel(**channel_dict)
+        COLLECTION_LOAD_SECONDS.set(time.perf_counter() - started, "channels")
     except Exception as e:
+        PERSISTENCE_ERRORS.inc("channels", "load")
         print(f"加载channels数据失败: {e}")
 
+def save_media_to_file():
+    """保存media索引到文件"""
+    started = time.perf_counter()
+    try:
+        with profile_section("serialization"):
+            # 将MediaAsset对象转换为字典
+            media_data = {media_id: asset.model_dump() for media_id, asset in media_db.items()}
+            payload = json.dumps(media_data, ensure_ascii=False, indent=2).encode('utf-8')
+        with profile_section("file_io"), open(MEDIA_FILE, 'wb') as f:
+            f.write(payload)
+        PERSISTENCE_FLUSH_DURATION.observe(time.perf_counter() - started, "media")
+        PERSISTENCE_BYTES_WRITTEN.inc("media", amount=len(payload))
+    except Exception as e:
+        PERSISTENCE_ERRORS.inc("media", "save")
+        print(f"保存media数据失败: {e}")
+
+def load_media_from_file():
+    """从文件加载media索引"""
+    started = time.perf_counter()
+    try:
+        if os.path.exists(MEDIA_FILE):
+            with open(MEDIA_FILE, 'r', encoding='utf-8') as f:
+                media_data = json.load(f)
+                # 将字典转换为MediaAsset对象
+                for media_id, asset_dict in media_data.items():
+                    media_db[media_id] = MediaAsset(**asset_dict)
+        COLLECTION_LOAD_SECONDS.set(time.perf_counter() - started, "media")
+    except Exception as e:
+        PERSISTENCE_ERRORS.inc("media", "load")
+        print(f"加载media数据失败: {e}")
+
 # 初始化示例数据
 def init_sample_data():
-    # 先尝试从文件加载数据
-    load_bricks_from_file()
-    load_templates_from_file()
-    
     # 如果没有数据，则创建示例数据
     if not bricks_db:
         sample_bricks = [
@@ -396,12 +1038,83 @@ def init_sample_data():
         
         save_channels_to_file()
 
+# 分面计数
+class FacetIndex:
+    """按字段增量维护取值计数，记录变更时先 remove 旧值再 add 新值"""
+
+    def __init__(self, fields: List[str], extract):
+        # extract: 记录 -> {字段: 取值集合}
+        self.fields = fields
+        self.extract = extract
+        self.total = 0
+        self.counts: Dict[str, Dict[str, int]] = {field: {} for field in fields}
+
+    def add(self, record, delta: int = 1):
+        self.total += delta
+        for field, values in self.extract(record).items():
+            field_counts = self.counts[field]
+            for value in values:
+                count = field_counts.get(value, 0) + delta
+                if count > 0:
+                    field_counts[value] = count
+                else:
+                    field_counts.pop(value, None)
+
+    def remove(self, record):
+        self.add(record, -1)
+
+    def rebuild(self, records):
+        self.total = 0
+        self.counts = {field: {} for field in self.fields}
+        for record in records:
+            self.add(record)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return facet_response(self.total, self.counts)
+
+def facet_response(total: int, counts: Dict[str, Dict[str, int]]) -> Dict[str, Any]:
+    """各字段按计数降序输出"""
+    return {
+        "total": total,
+        **{
+            field: dict(sorted(field_counts.items(), key=lambda item: (-item[1], item[0])))
+            for field, field_counts in counts.items()
+        },
+    }
+
+def count_facets(index: FacetIndex, records) -> Dict[str, Any]:
+    """带搜索条件时无法复用增量计数，只对过滤后的记录现算"""
+    scratch = FacetIndex(index.fields, index.extract)
+    scratch.rebuild(records)
+    return scratch.snapshot()
+
+def brick_facet_values(brick: ContentBrick) -> Dict[str, Set[str]]:
+    return {"type": {brick.type}, "tag": set(brick.tags)}
+
+def template_facet_values(template: ContentTemplate) -> Dict[str, Set[str]]:
+    return {
+        "type": {brick.type for brick in template.bricks},
+        "tag": set(template.tags),
+        "category": {template.category},
+    }
+
+brick_facets = FacetIndex(["type", "tag"], brick_facet_values)
+template_facets = FacetIndex(["type", "tag", "category"], template_facet_values)
+
 # 启动时加载数据
 load_bricks_from_file()
 load_templates_from_file()
 load_compositions_from_file()
 load_channels_from_file()
+load_media_from_file()
 init_sample_data()
+# 所有集合都加载成功时才清理，避免误删加载失败集合引用的正文；
+# 否则运行期间也不删除，孤儿正文留到下次正常启动时回收
+if not any(operation == "load" for _, operation in PERSISTENCE_ERRORS.values):
+    blob_store.deletion_enabled = True
+    blob_store.collect_garbage()
+brick_facets.rebuild(bricks_db.values())
+template_facets.rebuild(templates_db.values())
 
 # API 路由
 
@@ -414,23 +1127,69 @@ async def root():
 @app.get("/bricks", response_model=List[ContentBrick])
 async def get_bricks(type: Optional[str] = None, search: Optional[str] = None):
     """获取积木列表"""
+    with profile_section("filtering"):
+        return filter_bricks(type, search)
+
+def filter_bricks(type: Optional[str] = None, search: Optional[str] = None) -> List[ContentBrick]:
     bricks = list(bricks_db.values())
-    
+
     # 按类型过滤
     if type and type != "all":
         bricks = [brick for brick in bricks if brick.type == type]
-    
+
     # 按搜索关键词过滤
     if search:
         search_lower = search.lower()
         bricks = [
-            brick for brick in bricks 
-            if search_lower in brick.content.lower() or 
+            brick for brick in bricks
+            if search_lower in brick.content.lower() or
                any(search_lower in tag.lower() for tag in brick.tags)
         ]
-    
+
     return bricks
 
+def brick_content_fields(content: str) -> Dict[str, str]:
+    # 与存储一致：小正文不单独存文件，也就没有可供 /blobs 获取的哈希
+    if is_inline_content(content):
+        return {"content": content}
+    return {"contentHash": blob_store.hash_of(content)}
+
+@app.get("/bricks/summaries", response_model=List[BrickSummary])
+async def get_brick_summaries(type: Optional[str] = None):
+    """获取不含正文的积木列表"""
+    bricks = filter_bricks(type)
+    with profile_section("serialization"):
+        return [
+            BrickSummary(
+                contentLength=len(brick.content),
+                **brick_content_fields(brick.content),
+                **brick.model_dump(exclude={"content"}),
+            )
+            for brick in bricks
+        ]
+
+@app.get("/blobs/{blob_hash}", response_class=PlainTextResponse)
+async def get_blob(blob_hash: str):
+    """按哈希获取积木正文，内容不可变，可长期缓存"""
+    if len(blob_hash) != 64 or any(c not in "0123456789abcdef" for c in blob_hash):
+        raise HTTPException(status_code=400, detail="无效的内容哈希")
+    if blob_store.refcount(blob_hash) == 0 or not blob_store.exists(blob_hash):
+        raise HTTPException(status_code=404, detail="内容未找到")
+    with profile_section("file_io"):
+        content = blob_store.read(blob_hash)
+    return PlainTextResponse(content, headers={
+        "ETag": f'"{blob_hash}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+    })
+
+@app.get("/bricks/facets")
+async def get_brick_facets(search: Optional[str] = None):
+    """积木按类型、标签的计数"""
+    if not search:
+        return brick_facets.snapshot()
+    with profile_section("filtering"):
+        return count_facets(brick_facets, filter_bricks(search=search))
+
 @app.get("/bricks/{brick_id}", response_model=ContentBrick)
 async def get_brick(brick_id: str):
     """获取单个积木"""
@@ -457,6 +1216,7 @@ async def create_brick(brick_request: CreateBrickRequest):
     )
     
     bricks_db[brick_id] = brick
+    brick_facets.add(brick)
     save_bricks_to_file()  # 保存到文件
     return brick
 
@@ -467,6 +1227,7 @@ async def update_brick(brick_id: str, brick_request: UpdateBrickRequest):
         raise HTTPException(status_code=404, detail="积木未找到")
     
     brick = bricks_db[brick_id]
+    brick_facets.remove(brick)
     
     # 更新字段
     if brick_request.title is not None:
@@ -481,6 +1242,7 @@ async def update_brick(brick_id: str, brick_request: UpdateBrickRequest):
     # 更新版本和时间
     brick.version += 1
     brick.updatedAt = datetime.now().isoformat()
+    brick_facets.add(brick)
     
     save_bricks_to_file()  # 保存到文件
     return brick
@@ -491,7 +1253,7 @@ async def delete_brick(brick_id: str):
     if brick_id not in bricks_db:
         raise HTTPException(status_code=404, detail="积木未找到")
     
-    del bricks_db[brick_id]
+    brick_facets.remove(bricks_db.pop(brick_id))
     save_bricks_to_file()  # 保存到文件
     return {"message": "积木已删除"}
 
@@ -502,6 +1264,21 @@ async def get_templates():
     """获取模板列表"""
     return list(templates_db.values())
 
+@app.get("/templates/facets")
+async def get_template_facets(search: Optional[str] = None):
+    """模板按分类、标签及所含积木类型的计数"""
+    if not search:
+        return template_facets.snapshot()
+    search_lower = search.lower()
+    with profile_section("filtering"):
+        templates = [
+            template for template in templates_db.values()
+            if search_lower in template.name.lower() or
+               search_lower in template.description.lower() or
+               any(search_lower in tag.lower() for tag in template.tags)
+        ]
+        return count_facets(template_facets, templates)
+
 @app.get("/templates/{template_id}", response_model=ContentTemplate)
 async def get_template(template_id: str):
     """获取单个模板"""
@@ -532,6 +1309,7 @@ async def create_template(template_request: CreateTemplateRequest):
     )
     
     templates_db[template_id] = template
+    template_facets.add(template)
     save_templates_to_file()  # 保存到文件
     return template
 
@@ -542,6 +1320,7 @@ async def update_template(template_id: str, template_request: UpdateTemplateRequ
         raise HTTPException(status_code=404, detail="模板未找到")
     
     template = templates_db[template_id]
+    template_facets.remove(template)
     now = datetime.now().isoformat()
     
     # 更新字段
@@ -561,6 +1340,7 @@ async def update_template(template_id: str, template_request: UpdateTemplateRequ
         template.tags = template_request.tags
     
     template.updatedAt = now
+    template_facets.add(template)
     
     templates_db[template_id] = template
     save_templates_to_file()  # 保存到文件
@@ -578,6 +1358,7 @@ async def use_template(template_id: str):
     
     templates_db[template_id] = template
     save_templates_to_file()  # 保存到文件
+    record_events([(time.time(), "template_used", template_id)])
     return {"message": "模板使用次数已更新", "usageCount": template.usageCount}
 
 @app.delete("/templates/{template_id}")
@@ -586,7 +1367,7 @@ async def delete_template(template_id: str):
     if template_id not in templates_db:
         raise HTTPException(status_code=404, detail="模板未找到")
     
-    del templates_db[template_id]
+    template_facets.remove(templates_db.pop(template_id))
     save_templates_to_file()  # 保存到文件
     return {"message": "模板已删除"}
 
@@ -664,6 +1445,7 @@ async def save_generated_content_as_brick(request: SaveAsBrickRequest):
     
     # 保存到数据库
     bricks_db[brick_id] = brick
+    brick_facets.add(brick)
     save_bricks_to_file()  # 持久化到文件
     
     return brick
@@ -712,9 +1494,437 @@ async def delete_composition(composition_id: str):
     
     del compositions_db[composition_id]
     save_compositions_to_file()
-    
+    composition_hub.broadcast(composition_id, {
+        "type": "deleted",
+        "compositionId": composition_id,
+        "seq": composition_hub.next_seq(composition_id),
+    })
+    composition_hub.close_room(composition_id)
+
     return {"message": "作品删除成功"}
 
+@app.patch("/compositions/{composition_id}", response_model=ContentComposition)
+async def patch_composition(composition_id: str, patch_request: PatchCompositionRequest):
+    """增量修改作品，并把操作广播给实时协作订阅者"""
+    if composition_id not in compositions_db:
+        raise HTTPException(status_code=404, detail="作品不存在")
+
+    return apply_composition_patch(composition_id, patch_request.operations, patch_request.clientId)
+
+# 实时协作
+
+# 每个连接的待发送消息上限，超过说明客户端消费太慢
+WS_SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", 256))
+
+class CompositionSubscriber:
+    """单个 WebSocket 连接，消息先进入有界队列再由独立任务发送"""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.client_id = str(uuid.uuid4())
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.closing = False
+
+    def offer(self, payload: str) -> bool:
+        """非阻塞入队，队列已满时返回 False"""
+        if self.closing:
+            return False
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def send_loop(self):
+        try:
+            while True:
+                payload = await self.queue.get()
+                if payload is None:
+                    # 队列中已有的消息发完后再关闭
+                    await self.close(4404, "composition deleted")
+                    return
+                await self.websocket.send_text(payload)
+        except (WebSocketDisconnect, RuntimeError):
+            # 连接已断开，由接收循环负责清理
+            pass
+
+    def close_after_pending(self):
+        """作品已删除：放入结束标记，队列满时直接关闭"""
+        if self.closing:
+            return
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            asyncio.create_task(self.close(4404, "composition deleted"))
+        self.closing = True
+
+    async def close(self, code: int, reason: str):
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def close_slow(self):
+        # 1013: Try Again Later，客户端重连后会收到新的快照
+        await self.close(1013, "subscriber too slow")
+
+class CompositionHub:
+    """按作品维护订阅者，负责序号分配和增量广播"""
+
+    def __init__(self):
+        self.rooms: Dict[str, Set[CompositionSubscriber]] = {}
+        self.sequences: Dict[str, int] = {}
+
+    def subscribe(self, composition_id: str, subscriber: CompositionSubscriber):
+        self.rooms.setdefault(composition_id, set()).add(subscriber)
+
+    def unsubscribe(self, composition_id: str, subscriber: CompositionSubscriber):
+        room = self.rooms.get(composition_id)
+        if room is None:
+            return
+        room.discard(subscriber)
+        if not room:
+            del self.rooms[composition_id]
+
+    def current_seq(self, composition_id: str) -> int:
+        return self.sequences.get(composition_id, 0)
+
+    def next_seq(self, composition_id: str) -> int:
+        seq = self.sequences.get(composition_id, 0) + 1
+        self.sequences[composition_id] = seq
+        return seq
+
+    def broadcast(self, composition_id: str, message: Dict[str, Any]):
+        """消息只序列化一次，入队不等待；队列满的连接直接断开，不拖慢其他订阅者"""
+        room = self.rooms.get(composition_id)
+        if not room:
+            return
+        payload = json.dumps(message, ensure_ascii=False)
+        for subscriber in list(room):
+            if not subscriber.offer(payload):
+                subscriber.closing = True
+                self.unsubscribe(composition_id, subscriber)
+                asyncio.create_task(subscriber.close_slow())
+
+    def close_room(self, composition_id: str):
+        """作品删除后断开全部订阅者并丢弃序号"""
+        for subscriber in self.rooms.pop(composition_id, set()):
+            subscriber.close_after_pending()
+        self.sequences.pop(composition_id, None)
+
+composition_hub = CompositionHub()
+
+METRICS.append(Gauge(
+    "websocket_subscribers", "实时协作通道当前连接数",
+    collect=lambda: sum(len(room) for room in composition_hub.rooms.values()),
+))
+
+def _find_brick_index(bricks: List[ContentBrick], operation: CompositionOperation) -> int:
+    if operation.brickId is not None:
+        for i, brick in enumerate(bricks):
+            if brick.id == operation.brickId:
+                return i
+        raise HTTPException(status_code=404, detail="积木未找到")
+    if operation.index is None or not 0 <= operation.index < len(bricks):
+        raise HTTPException(status_code=400, detail="操作缺少有效的 brickId 或 index")
+    return operation.index
+
+def apply_composition_patch(composition_id: str, operations: List[CompositionOperation],
+                            client_id: Optional[str] = None) -> ContentComposition:
+    """在副本上依次应用操作，全部成功后才写回、持久化并广播"""
+    composition = compositions_db[composition_id]
+    bricks = list(composition.bricks)
+    now = datetime.now().isoformat()
+
+    for operation in operations:
+        if operation.op == "insert":
+            if operation.brick is None:
+                raise HTTPException(status_code=400, detail="insert 操作缺少 brick")
+            # brickId 定位只取第一个匹配，同一作品中的积木 ID 必须唯一
+            if any(brick.id == operation.brick.id for brick in bricks):
+                raise HTTPException(status_code=409, detail="作品中已有相同 ID 的积木")
+            index = len(bricks) if operation.index is None else max(0, min(operation.index, len(bricks)))
+            bricks.insert(index, operation.brick)
+        elif operation.op == "move":
+            if operation.toIndex is None:
+                raise HTTPException(status_code=400, detail="move 操作缺少 toIndex")
+            brick = bricks.pop(_find_brick_index(bricks, operation))
+            bricks.insert(max(0, min(operation.toIndex, len(bricks))), brick)
+        elif operation.op == "update":
+            if operation.changes is None:
+                raise HTTPException(status_code=400, detail="update 操作缺少 changes")
+            index = _find_brick_index(bricks, operation)
+            changes = operation.changes.model_dump(exclude_none=True)
+            # 重新校验，嵌套的 metadata 才会还原成 BrickMetadata
+            bricks[index] = ContentBrick.model_validate({
+                **bricks[index].model_dump(),
+                **changes,
+                "version": bricks[index].version + 1,
+                "updatedAt": now,
+            })
+        elif operation.op == "remove":
+            del bricks[_find_brick_index(bricks, operation)]
+        else:
+            raise HTTPException(status_code=400, detail=f"不支持的操作: {operation.op}")
+
+    composition.bricks = bricks
+    composition.updatedAt = now
+    save_compositions_to_file()
+
+    composition_hub.broadcast(composition_id, {
+        "type": "patch",
+        "compositionId": composition_id,
+        "seq": composition_hub.next_seq(composition_id),
+        "clientId": client_id,
+        "operations": [operation.model_dump(exclude_none=True) for operation in operations],
+        "updatedAt": now,
+    })
+    return composition
+
+@app.websocket("/ws/compositions/{composition_id}")
+async def composition_channel(websocket: WebSocket, composition_id: str):
+    """作品协作通道：连接后先下发快照，之后只推送增量操作"""
+    if composition_id not in compositions_db:
+        await websocket.close(code=4404)
+        return
+
+    await websocket.accept()
+    subscriber = CompositionSubscriber(websocket)
+    subscriber.offer(json.dumps({
+        "type": "snapshot",
+        "compositionId": composition_id,
+        "clientId": subscriber.client_id,
+        "seq": composition_hub.current_seq(composition_id),
+        "composition": compositions_db[composition_id].model_dump(),
+    }, ensure_ascii=False))
+    composition_hub.subscribe(composition_id, subscriber)
+    sender = asyncio.create_task(subscriber.send_loop())
+    client = client_key(websocket)
+
+    try:
+        while True:
+            message = await websocket.receive_text()
+            # 客户端也可以直接通过通道提交操作，每次提交都会重写作品文件，按写接口限流
+            try:
+                async with write_admission(client):
+                    message = json.loads(message)
+                    if composition_id not in compositions_db:
+                        raise HTTPException(status_code=404, detail="作品不存在")
+                    operations = [CompositionOperation(**op) for op in message.get("operations", [])]
+                    apply_composition_patch(composition_id, operations, subscriber.client_id)
+            except HTTPException as e:
+                subscriber.offer(json.dumps({"type": "error", "detail": e.detail}, ensure_ascii=False))
+            except (ValueError, TypeError, AttributeError) as e:
+                subscriber.offer(json.dumps({"type": "error", "detail": str(e)}, ensure_ascii=False))
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        composition_hub.unsubscribe(composition_id, subscriber)
+        sender.cancel()
+
+# 媒体资源 API
+# 图片、视频等积木素材上传后按内容哈希存放在 data/media/，
+# 支持 Range 请求；服务器支持 ASGI zerocopy 扩展时直接交给内核 sendfile
+
+MEDIA_CHUNK_SIZE = 256 * 1024
+MEDIA_MAX_BYTES = int(os.environ.get("MEDIA_MAX_BYTES", 200 * 1024 * 1024))
+# multipart 边界和字段头占用的字节数余量，请求体按 MEDIA_MAX_BYTES 加上它限制
+MEDIA_FORM_OVERHEAD = 64 * 1024
+MEDIA_ALLOWED_PREFIXES = ("image/", "video/", "audio/")
+
+def parse_range(range_header: Optional[str], size: int):
+    """解析单段 Range 头，返回 (start, end)；无需分段时返回 None，无法满足时抛出 ValueError"""
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+    ranges = range_header[len("bytes="):].split(",")
+    if len(ranges) != 1:
+        # 多段请求直接返回整个文件，协议允许这样处理
+        return None
+    start_text, _, end_text = ranges[0].strip().partition("-")
+    if not start_text:
+        # bytes=-N 表示最后 N 个字节
+        length = int(end_text)
+        if length <= 0:
+            raise ValueError("unsatisfiable range")
+        return max(0, size - length), size - 1
+    start = int(start_text)
+    end = int(end_text) if end_text else size - 1
+    if start >= size or end < start:
+        raise ValueError("unsatisfiable range")
+    return start, min(end, size - 1)
+
+class MediaFileResponse(Response):
+    """支持 Range 的文件响应，优先使用 http.response.zerocopy，否则按块 pread"""
+
+    def __init__(self, path: str, asset: MediaAsset, request: Request):
+        super().__init__(status_code=200, media_type=asset.contentType)
+        self.path = path
+        self.send_body = request.method != "HEAD"
+        self.offset = 0
+        self.count = asset.size
+        self.headers["Accept-Ranges"] = "bytes"
+        self.headers["ETag"] = f'"{asset.id}"'
+        # 文件按内容哈希命名，内容不会变化
+        self.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+
+        if request.headers.get("if-none-match") == f'"{asset.id}"':
+            self.status_code = 304
+            self.count = 0
+            del self.headers["Content-Type"]
+            return
+
+        try:
+            byte_range = parse_range(request.headers.get("range"), asset.size)
+        except ValueError:
+            self.status_code = 416
+            self.count = 0
+            self.headers["Content-Range"] = f"bytes */{asset.size}"
+            return
+        if byte_range is not None:
+            start, end = byte_range
+            self.status_code = 206
+            self.offset = start
+            self.count = end - start + 1
+            self.headers["Content-Range"] = f"bytes {start}-{end}/{asset.size}"
+        self.headers["Content-Length"] = str(self.count)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        with open(self.path, "rb") as f:
+            if "http.response.zerocopy" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": f.fileno(),
+                    "offset": self.offset,
+                    "count": self.count,
+                    "more_body": False,
+                })
+                return
+
+            fd = f.fileno()
+            offset = self.offset
+            remaining = self.count
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, min(MEDIA_CHUNK_SIZE, remaining), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # 文件被截断，结束响应避免客户端一直等待
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+def media_path(media_id: str) -> str:
+    return os.path.join(MEDIA_DIR, media_id[:2], media_id[2:])
+
+class MediaUploadLimitMiddleware:
+    """在 multipart 解析把文件落到临时文件之前拒绝过大的上传：
+    先看 Content-Length，分块传输没有该头时按已接收的字节数中止"""
+
+    def __init__(self, app, max_body: int = MEDIA_MAX_BYTES + MEDIA_FORM_OVERHEAD):
+        self.app = app
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != "/media":
+            await self.app(scope, receive, send)
+            return
+        content_length = Headers(scope=scope).get("content-length", "")
+        if content_length.isdigit() and int(content_length) > self.max_body:
+            response = JSONResponse({"detail": "文件过大"}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    raise HTTPException(status_code=413, detail="文件过大")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(MediaUploadLimitMiddleware)
+
+@app.post("/media", response_model=MediaAsset)
+async def upload_media(file: UploadFile = File(...)):
+    """上传积木素材，相同文件只存一份"""
+    content_type = file.content_type or mimetypes.guess_type(file.filename or "")[0] or ""
+    if not content_type.startswith(MEDIA_ALLOWED_PREFIXES):
+        raise HTTPException(status_code=415, detail="只支持图片、视频和音频文件")
+
+    # 边读边算哈希写入临时文件，不把整个文件放进内存
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = os.path.join(MEDIA_DIR, f"upload-{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = await file.read(MEDIA_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MEDIA_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail="文件过大")
+                digest.update(chunk)
+                f.write(chunk)
+
+        media_id = digest.hexdigest()
+        if media_id not in media_db:
+            path = media_path(media_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            media_db[media_id] = MediaAsset(
+                id=media_id,
+                filename=file.filename or media_id,
+                contentType=content_type,
+                size=size,
+                url=f"/media/{media_id}",
+                createdAt=datetime.now().isoformat(),
+            )
+            save_media_to_file()
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return media_db[media_id]
+
+@app.get("/media", response_model=List[MediaAsset])
+async def get_media_list():
+    """获取所有素材"""
+    return list(media_db.values())
+
+@app.api_route("/media/{media_id}", methods=["GET", "HEAD"])
+async def get_media(media_id: str, request: Request):
+    """下载素材，支持 Range 断点和拖动播放"""
+    if media_id not in media_db:
+        raise HTTPException(status_code=404, detail="素材未找到")
+    return MediaFileResponse(media_path(media_id), media_db[media_id], request)
+
+@app.delete("/media/{media_id}")
+async def delete_media(media_id: str):
+    """删除素材"""
+    if media_id not in media_db:
+        raise HTTPException(status_code=404, detail="素材未找到")
+
+    del media_db[media_id]
+    save_media_to_file()
+    try:
+        os.remove(media_path(media_id))
+    except FileNotFoundError:
+        pass
+
+    return {"message": "素材已删除"}
+
 # 渠道管理 API
 @app.get("/channels", response_model=List[PublishingChannel])
 async def get_channels():
@@ -829,6 +2039,7 @@ async def publish_to_channel(channel_id: str, composition_id: str):
     
     # 这里可以根据不同渠道类型实现实际的发布逻辑
     # 目前返回模拟结果
+    record_events([(time.time(), "composition_published", composition_id)])
     return {
         "success": True,
         "message": f"内容已成功发布到 {channel.name}",
@@ -836,6 +2047,744 @@ async def publish_to_channel(channel_id: str, composition_id: str):
         "publishedAt": datetime.now().isoformat()
     }
 
+# 数据分析 API
+# 事件按批追加到 data/analytics/ 下按天分文件的列式日志：每批一段，时间戳、事件类型、
+# 实体 ID 分列存放（ID 字典编码）后整体 zlib 压缩；仪表盘查询只读内存中的滚动分桶聚合，
+# 原始日志仅在启动时回放最近一周
+ANALYTICS_DIR = os.path.join(DATA_DIR, "analytics")
+ANALYTICS_EVENT_TYPES = ("brick_viewed", "template_used", "composition_published")
+ANALYTICS_MAX_BATCH = 1000
+ANALYTICS_MAX_ENTITY_ID_LENGTH = 256
+ANALYTICS_RETENTION_DAYS = int(os.environ.get("ANALYTICS_RETENTION_DAYS", 90))
+ANALYTICS_SEGMENT_MAGIC = b"CLEV"
+# 魔数、行数、压缩后长度
+ANALYTICS_SEGMENT_HEADER = struct.Struct("<4sII")
+# 基准时间戳、字典条目数、字典字节数
+ANALYTICS_PAYLOAD_HEADER = struct.Struct("<dII")
+# 窗口 -> (分桶粒度秒数, 分桶数)
+ANALYTICS_WINDOWS = {
+    "hour": (60, 60),
+    "day": (3600, 24),
+    "week": (3600, 168),
+}
+
+os.makedirs(ANALYTICS_DIR, exist_ok=True)
+
+def encode_event_segment(timestamps: List[float], type_codes: List[int], entity_ids: List[str]) -> bytes:
+    base = min(timestamps)
+    dictionary: Dict[str, int] = {}
+    indices = array("I", (dictionary.setdefault(entity_id, len(dictionary)) for entity_id in entity_ids))
+    deltas = array("I", (int(round((ts - base) * 1000)) for ts in timestamps))
+    # 字典条目按长度前缀存放，ID 中出现任何字符都不会破坏切分
+    encoded_ids = [entity_id.encode("utf-8") for entity_id in dictionary]
+    lengths = array("I", (len(encoded) for encoded in encoded_ids))
+    dictionary_bytes = b"".join(encoded_ids)
+    payload = b"".join([
+        ANALYTICS_PAYLOAD_HEADER.pack(base, len(dictionary), len(dictionary_bytes)),
+        deltas.tobytes(),
+        bytes(type_codes),
+        indices.tobytes(),
+        lengths.tobytes(),
+        dictionary_bytes,
+    ])
+    compressed = zlib.compress(payload)
+    return ANALYTICS_SEGMENT_HEADER.pack(ANALYTICS_SEGMENT_MAGIC, len(timestamps), len(compressed)) + compressed
+
+def decode_event_segments(data: bytes):
+    """逐段解码，产出 (时间戳, 事件类型, 实体 ID)；遇到写了一半的尾段时停止，段内容不一致时抛出 ValueError"""
+    offset = 0
+    while offset + ANALYTICS_SEGMENT_HEADER.size <= len(data):
+        magic, rows, length = ANALYTICS_SEGMENT_HEADER.unpack_from(data, offset)
+        offset += ANALYTICS_SEGMENT_HEADER.size
+        if magic != ANALYTICS_SEGMENT_MAGIC or offset + length > len(data):
+            return
+        try:
+            payload = zlib.decompress(data[offset:offset + length])
+        except zlib.error as e:
+            raise ValueError("analytics 日志段已损坏") from e
+        offset += length
+
+        base, entries, dictionary_length = ANALYTICS_PAYLOAD_HEADER.unpack_from(payload)
+        position = ANALYTICS_PAYLOAD_HEADER.size
+        deltas = array("I")
+        deltas.frombytes(payload[position:position + rows * deltas.itemsize])
+        position += rows * deltas.itemsize
+        type_codes = payload[position:position + rows]
+        position += rows
+        indices = array("I")
+        indices.frombytes(payload[position:position + rows * indices.itemsize])
+        position += rows * indices.itemsize
+        lengths = array("I")
+        lengths.frombytes(payload[position:position + entries * lengths.itemsize])
+        position += entries * lengths.itemsize
+        if (len(deltas) != rows or len(type_codes) != rows or len(indices) != rows
+                or len(lengths) != entries or sum(lengths) != dictionary_length
+                or position + dictionary_length != len(payload)):
+            raise ValueError("analytics 日志段已损坏")
+        dictionary = []
+        for entry_length in lengths:
+            dictionary.append(payload[position:position + entry_length].decode("utf-8"))
+            position += entry_length
+        if any(index >= entries for index in indices) or any(code >= len(ANALYTICS_EVENT_TYPES) for code in type_codes):
+            raise ValueError("analytics 日志段已损坏")
+
+        for delta, type_code, index in zip(deltas, type_codes, indices):
+            yield base + delta / 1000, ANALYTICS_EVENT_TYPES[type_code], dictionary[index]
+
+def torn_tail_offset(data: bytes) -> Optional[int]:
+    """只看段头：末尾有写了一半的段时返回它的起始位置，否则返回 None"""
+    offset = 0
+    while offset + ANALYTICS_SEGMENT_HEADER.size <= len(data):
+        magic, _, length = ANALYTICS_SEGMENT_HEADER.unpack_from(data, offset)
+        end = offset + ANALYTICS_SEGMENT_HEADER.size + length
+        if magic != ANALYTICS_SEGMENT_MAGIC:
+            # 中间已损坏，不是尾段问题，不截断
+            return None
+        if end > len(data):
+            return offset
+        offset = end
+    return offset if offset < len(data) else None
+
+def truncate_torn_tail(path: str):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return
+    offset = torn_tail_offset(data)
+    if offset is not None:
+        with open(path, "r+b") as f:
+            f.truncate(offset)
+
+def analytics_log_path(timestamp: float) -> str:
+    return os.path.join(ANALYTICS_DIR, f"events-{datetime.fromtimestamp(timestamp).strftime('%Y%m%d')}.col")
+
+class RollingCounts:
+    """固定粒度的环形分桶：桶序号 -> 事件类型 -> 实体 ID -> 次数"""
+
+    def __init__(self, bucket_seconds: int, bucket_count: int):
+        self.bucket_seconds = bucket_seconds
+        self.bucket_count = bucket_count
+        self.buckets: Dict[int, Dict[str, Dict[str, int]]] = {}
+
+    def add(self, timestamp: float, event_type: str, entity_id: str, now: float):
+        bucket = int(timestamp // self.bucket_seconds)
+        oldest = int(now // self.bucket_seconds) - self.bucket_count + 1
+        if bucket < oldest:
+            return
+        entity_counts = self.buckets.setdefault(bucket, {}).setdefault(event_type, {})
+        entity_counts[entity_id] = entity_counts.get(entity_id, 0) + 1
+
+    def expire(self, now: float):
+        oldest = int(now // self.bucket_seconds) - self.bucket_count + 1
+        for bucket in [bucket for bucket in self.buckets if bucket < oldest]:
+            del self.buckets[bucket]
+
+class AnalyticsAggregates:
+    """各查询窗口对应的滚动聚合，day 与 week 共用小时分桶"""
+
+    def __init__(self):
+        self.minutes = RollingCounts(60, ANALYTICS_WINDOWS["hour"][1])
+        self.hours = RollingCounts(3600, ANALYTICS_WINDOWS["week"][1])
+
+    def add(self, timestamp: float, event_type: str, entity_id: str, now: float):
+        self.minutes.add(timestamp, event_type, entity_id, now)
+        self.hours.add(timestamp, event_type, entity_id, now)
+
+    def query(self, window: str, limit: int, now: float) -> Dict[str, Any]:
+        bucket_seconds, bucket_count = ANALYTICS_WINDOWS[window]
+        rolling = self.minutes if bucket_seconds == 60 else self.hours
+        rolling.expire(now)
+        last = int(now // bucket_seconds)
+        first = last - bucket_count + 1
+
+        totals = {event_type: 0 for event_type in ANALYTICS_EVENT_TYPES}
+        entities: Dict[str, Dict[str, int]] = {event_type: {} for event_type in ANALYTICS_EVENT_TYPES}
+        series = []
+        for bucket in range(first, last + 1):
+            counts = {event_type: 0 for event_type in ANALYTICS_EVENT_TYPES}
+            for event_type, entity_counts in rolling.buckets.get(bucket, {}).items():
+                merged = entities[event_type]
+                for entity_id, count in entity_counts.items():
+                    counts[event_type] += count
+                    merged[entity_id] = merged.get(entity_id, 0) + count
+                totals[event_type] += counts[event_type]
+            series.append({"start": datetime.fromtimestamp(bucket * bucket_seconds).isoformat(), "counts": counts})
+
+        return {
+            "window": window,
+            "from": datetime.fromtimestamp(first * bucket_seconds).isoformat(),
+            "to": datetime.fromtimestamp(now).isoformat(),
+            "bucketSeconds": bucket_seconds,
+            "totals": totals,
+            "series": series,
+            "top": {
+                event_type: [
+                    {"entityId": entity_id, "count": count}
+                    for entity_id, count in heapq.nlargest(limit, entity_counts.items(), key=lambda item: item[1])
+                ]
+                for event_type, entity_counts in entities.items()
+            },
+        }
+
+analytics_aggregates = AnalyticsAggregates()
+# 本进程内已确认没有残缺尾段的日志文件；进程中途退出可能留下写了一半的段，
+# 不截掉的话后续追加的段会接在它后面，回放时整个文件从这里开始都读不出来
+analytics_checked_paths: Set[str] = set()
+
+def record_events(events: List[tuple]):
+    """events: [(时间戳, 事件类型, 实体 ID)]；按天分组追加到日志，并更新内存聚合"""
+    now = time.time()
+    by_file: Dict[str, List[tuple]] = {}
+    for event in events:
+        by_file.setdefault(analytics_log_path(event[0]), []).append(event)
+    try:
+        with profile_section("file_io"):
+            for path, file_events in by_file.items():
+                segment = encode_event_segment(
+                    [event[0] for event in file_events],
+                    [ANALYTICS_EVENT_TYPES.index(event[1]) for event in file_events],
+                    [event[2] for event in file_events],
+                )
+                if path not in analytics_checked_paths:
+                    truncate_torn_tail(path)
+                    analytics_checked_paths.add(path)
+                try:
+                    with open(path, "ab") as f:
+                        f.write(segment)
+                except OSError:
+                    # 可能只写入了一部分，下次追加前重新检查
+                    analytics_checked_paths.discard(path)
+                    raise
+                PERSISTENCE_BYTES_WRITTEN.inc("analytics", amount=len(segment))
+    except Exception as e:
+        PERSISTENCE_ERRORS.inc("analytics", "save")
+        print(f"保存analytics事件失败: {e}")
+    for timestamp, event_type, entity_id in events:
+        analytics_aggregates.add(timestamp, event_type, entity_id, now)
+    ANALYTICS_EVENTS.inc(amount=len(events))
+
+def load_analytics_from_file():
+    """回放最近一周的事件日志重建聚合，并删除超过保留期的日志"""
+    started = time.perf_counter()
+    now = time.time()
+    week_start = now - ANALYTICS_WINDOWS["week"][0] * ANALYTICS_WINDOWS["week"][1]
+    first_day = datetime.fromtimestamp(week_start).strftime("%Y%m%d")
+    expired_day = datetime.fromtimestamp(now - ANALYTICS_RETENTION_DAYS * 86400).strftime("%Y%m%d")
+    try:
+        for name in sorted(os.listdir(ANALYTICS_DIR)):
+            if not (name.startswith("events-") and name.endswith(".col")):
+                continue
+            day = name[len("events-"):-len(".col")]
+            if day < expired_day:
+                os.remove(os.path.join(ANALYTICS_DIR, name))
+                continue
+            if day < first_day:
+                continue
+            with open(os.path.join(ANALYTICS_DIR, name), "rb") as f:
+                data = f.read()
+            try:
+                for timestamp, event_type, entity_id in decode_event_segments(data):
+                    analytics_aggregates.add(timestamp, event_type, entity_id, now)
+            except ValueError as e:
+                # 损坏处之前的事件已计入，只跳过该文件剩余部分，继续回放其他日期
+                PERSISTENCE_ERRORS.inc("analytics", "load")
+                print(f"analytics 日志 {name} 已损坏，跳过剩余部分: {e}")
+        COLLECTION_LOAD_SECONDS.set(time.perf_counter() - started, "analytics")
+    except Exception as e:
+        PERSISTENCE_ERRORS.inc("analytics", "load")
+        print(f"加载analytics数据失败: {e}")
+
+ANALYTICS_EVENTS = Counter("analytics_events_total", "接收的分析事件数")
+METRICS.append(ANALYTICS_EVENTS)
+
+load_analytics_from_file()
+
+@app.post("/analytics/events")
+async def ingest_analytics_events(batch: AnalyticsEventBatch):
+    """批量上报分析事件"""
+    if len(batch.events) > ANALYTICS_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"单批最多 {ANALYTICS_MAX_BATCH} 条事件")
+
+    now = time.time()
+    oldest = now - ANALYTICS_WINDOWS["week"][0] * ANALYTICS_WINDOWS["week"][1]
+    events = []
+    dropped = 0
+    for event in batch.events:
+        if event.type not in ANALYTICS_EVENT_TYPES:
+            raise HTTPException(status_code=400, detail=f"不支持的事件类型: {event.type}")
+        if not event.entityId or len(event.entityId) > ANALYTICS_MAX_ENTITY_ID_LENGTH:
+            raise HTTPException(status_code=400, detail=f"entityId 长度须在 1 到 {ANALYTICS_MAX_ENTITY_ID_LENGTH} 之间")
+        if event.timestamp:
+            try:
+                timestamp = datetime.fromisoformat(event.timestamp).timestamp()
+            except (ValueError, OverflowError, OSError):
+                raise HTTPException(status_code=400, detail=f"无效的时间戳: {event.timestamp}")
+            # 客户端时钟不可信，未来时间按接收时间处理；早于一周窗口的事件不再计入任何聚合，直接丢弃
+            if timestamp < oldest:
+                dropped += 1
+                continue
+            timestamp = min(timestamp, now)
+        else:
+            timestamp = now
+        events.append((timestamp, event.type, event.entityId))
+
+    if events:
+        record_events(events)
+    return {"accepted": len(events), "dropped": dropped}
+
+@app.get("/analytics/summary")
+async def get_analytics_summary(window: str = "day", limit: int = 10):
+    """最近一小时 / 一天 / 一周的事件统计：总数、按时间分桶的趋势和各类事件的热门对象"""
+    if window not in ANALYTICS_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"window 只支持 {', '.join(ANALYTICS_WINDOWS)}")
+    return analytics_aggregates.query(window, max(0, min(limit, 100)), time.time())
+
+# 限流与准入控制
+# 令牌桶按客户端（已签发的 X-API-Key，否则用客户端地址）和路由类别（read / write / ai）分别限流；
+# 写接口和 AI 接口另有并发上限和有界等待队列，队列满或等待超时直接返回 503
+# 经 Next.js 代理（src/app/api/templates/*）的请求连接地址都是 Next 服务器，只有开启
+# RATE_LIMIT_TRUST_PROXY 才按 X-Forwarded-For 区分客户端，且只取最右一项（受信任的代理追加的地址），
+# 左侧各项由客户端提供、可以伪造；后端直接对外暴露时不要开启
+RATE_LIMIT_TRUST_PROXY = os.environ.get("RATE_LIMIT_TRUST_PROXY", "").lower() in ("1", "true", "yes")
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", 100000))
+# 已签发的 API Key（逗号分隔）；不在其中的 X-API-Key 一律忽略，否则客户端每次换一个 Key 就能拿到满桶，
+# 还会把真实客户端的桶挤出 LRU
+RATE_LIMIT_API_KEYS = frozenset(key.strip() for key in os.environ.get("RATE_LIMIT_API_KEYS", "").split(",") if key.strip())
+RATE_LIMIT_EXEMPT_PATHS = ("/health", "/metrics")
+# 类别 -> (每秒补充令牌数, 桶容量)；速率为 0 表示不限流
+RATE_LIMITS = {
+    "read": (float(os.environ.get("RATE_LIMIT_READ_RATE", 50)), float(os.environ.get("RATE_LIMIT_READ_BURST", 100))),
+    "write": (float(os.environ.get("RATE_LIMIT_WRITE_RATE", 5)), float(os.environ.get("RATE_LIMIT_WRITE_BURST", 20))),
+    "ai": (float(os.environ.get("RATE_LIMIT_AI_RATE", 0.5)), float(os.environ.get("RATE_LIMIT_AI_BURST", 5))),
+}
+# 类别 -> (最大并发, 最大排队数)
+ADMISSION_LIMITS = {
+    "write": (int(os.environ.get("ADMISSION_WRITE_CONCURRENCY", 4)), int(os.environ.get("ADMISSION_WRITE_QUEUE", 32))),
+    "ai": (int(os.environ.get("ADMISSION_AI_CONCURRENCY", 8)), int(os.environ.get("ADMISSION_AI_QUEUE", 16))),
+}
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 2.0))
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """取一个令牌，成功返回 0，否则返回需要等待的秒数"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class RateLimiter:
+    """每个 (客户端, 类别) 一个令牌桶，按最近使用淘汰以限制内存"""
+
+    def __init__(self, limits: Dict[str, tuple], max_clients: int):
+        self.limits = limits
+        self.max_clients = max_clients
+        self.buckets: "OrderedDict[tuple, TokenBucket]" = OrderedDict()
+
+    def check(self, client_key: str, route_class: str) -> float:
+        rate, burst = self.limits[route_class]
+        if rate <= 0:
+            return 0.0
+        key = (client_key, route_class)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(rate, burst)
+            if len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket.take()
+
+class AdmissionRejected(Exception):
+    pass
+
+class AdmissionController:
+    """并发上限 + 有界 FIFO 等待队列"""
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiters: "deque[asyncio.Future]" = deque()
+
+    async def acquire(self):
+        if self.in_flight < self.max_concurrent and not self.waiters:
+            self.in_flight += 1
+            return
+        if len(self.waiters) >= self.max_queue:
+            raise AdmissionRejected("queue full")
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done():
+                # 超时（或客户端断开）的同时被放行，把名额交给下一个
+                self.release()
+            else:
+                waiter.cancel()
+                self.waiters.remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise AdmissionRejected("queue timeout")
+
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                # 名额直接转交，in_flight 不变
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+rate_limiter = RateLimiter(RATE_LIMITS, RATE_LIMIT_MAX_CLIENTS)
+admission_controllers = {
+    route_class: AdmissionController(max_concurrent, max_queue, ADMISSION_QUEUE_TIMEOUT)
+    for route_class, (max_concurrent, max_queue) in ADMISSION_LIMITS.items()
+}
+
+REJECTED_REQUESTS = Counter("rejected_requests_total", "被限流或准入控制拒绝的请求数", ("route_class", "reason"))
+METRICS.append(REJECTED_REQUESTS)
+METRICS.append(Gauge(
+    "admission_in_flight", "准入控制下正在处理的请求数", ("route_class",),
+    collect=lambda: {(name,): controller.in_flight for name, controller in admission_controllers.items()},
+))
+METRICS.append(Gauge(
+    "admission_queued", "准入控制下排队等待的请求数", ("route_class",),
+    collect=lambda: {(name,): len(controller.waiters) for name, controller in admission_controllers.items()},
+))
+
+def classify_route(request: Request) -> Optional[str]:
+    path = request.url.path
+    if request.method == "OPTIONS" or path in RATE_LIMIT_EXEMPT_PATHS:
+        return None
+    if path.startswith("/ai/"):
+        return "ai"
+    if request.method in ("GET", "HEAD"):
+        return "read"
+    return "write"
+
+def client_key(request: HTTPConnection) -> str:
+    api_key = request.headers.get("x-api-key")
+    if api_key and api_key in RATE_LIMIT_API_KEYS:
+        return f"key:{api_key}"
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return f"ip:{forwarded.rsplit(',', 1)[-1].strip()}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+def match_route(scope):
+    """按路由表匹配请求，路径匹配但方法不匹配（405）时返回该路由"""
+    partial = None
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+        if match == Match.PARTIAL and partial is None:
+            partial = route
+    return partial
+
+def record_rejected_route(scope):
+    # 被拒绝的请求不会再进入路由，补上匹配的路由，监控指标才能按路由模板统计拒绝次数
+    route = match_route(scope)
+    if route is not None:
+        scope["route"] = route
+
+class RateLimitMiddleware:
+    """令牌桶限流和准入控制；纯 ASGI 实现，响应消息原样透传（包括 zerocopy 扩展消息）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        route_class = classify_route(request)
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = rate_limiter.check(client_key(request), route_class)
+        if retry_after > 0:
+            REJECTED_REQUESTS.inc(route_class, "rate_limit")
+            record_rejected_route(scope)
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "请求过于频繁，请稍后再试"},
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+            await response(scope, receive, send)
+            return
+
+        controller = admission_controllers.get(route_class)
+        if controller is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await controller.acquire()
+        except AdmissionRejected as e:
+            REJECTED_REQUESTS.inc(route_class, str(e).replace(" ", "_"))
+            record_rejected_route(scope)
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "服务繁忙，请稍后再试"},
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release()
+
+app.add_middleware(RateLimitMiddleware)
+
+@asynccontextmanager
+async def write_admission(client: str):
+    """不经过中间件的写操作（WebSocket 通道提交的操作）与 HTTP 写接口共用同一份限流和准入额度"""
+    retry_after = rate_limiter.check(client, "write")
+    if retry_after > 0:
+        REJECTED_REQUESTS.inc("write", "rate_limit")
+        raise HTTPException(status_code=429, detail="请求过于频繁，请稍后再试")
+    controller = admission_controllers.get("write")
+    if controller is None:
+        yield
+        return
+    try:
+        await controller.acquire()
+    except AdmissionRejected as e:
+        REJECTED_REQUESTS.inc("write", str(e).replace(" ", "_"))
+        raise HTTPException(status_code=503, detail="服务繁忙，请稍后再试")
+    try:
+        yield
+    finally:
+        controller.release()
+
+# 响应压缩
+# 较大的 JSON / 文本响应按 Accept-Encoding 协商使用 br（已安装 brotli 时）或 gzip，
+# 媒体文件和分段响应原样透传
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+# 超过该大小的响应体放到工作线程压缩（zlib / brotli 压缩时会释放 GIL），不阻塞事件循环
+COMPRESSION_THREAD_SIZE = int(os.environ.get("COMPRESSION_THREAD_SIZE", 64 * 1024))
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    for coding in (("br", "gzip") if brotli is not None else ("gzip",)):
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    # 低压缩级别：JSON 重复度高，级别 1 已能压到 10% 以内，CPU 开销却只有级别 6 的几分之一
+    if encoding == "br":
+        return brotli.compress(body, quality=1)
+    return gzip.compress(body, compresslevel=1)
+
+class CompressionMiddleware:
+    """缓冲可压缩的响应体，整体压缩后一次发出"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_headers = Headers(scope=scope)
+        encoding = negotiate_encoding(request_headers.get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        chunks: List[bytes] = []
+        passthrough = False
+
+        async def compressing_send(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                passthrough = (
+                    not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                    or "content-encoding" in headers
+                    or "content-range" in headers
+                )
+                if passthrough:
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            headers = MutableHeaders(raw=start_message["headers"])
+            if len(body) >= self.minimum_size:
+                if len(body) >= COMPRESSION_THREAD_SIZE:
+                    compressed = await anyio.to_thread.run_sync(compress_body, body, encoding)
+                else:
+                    compressed = compress_body(body, encoding)
+                RESPONSE_COMPRESSION_BYTES.inc(encoding, "in", amount=len(body))
+                RESPONSE_COMPRESSION_BYTES.inc(encoding, "out", amount=len(compressed))
+                body = compressed
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body, "more_body": False})
+
+        await self.app(scope, receive, compressing_send)
+
+app.add_middleware(CompressionMiddleware)
+
+# 监控
+
+# 事件循环延迟采样间隔（秒）
+EVENT_LOOP_LAG_INTERVAL = float(os.environ.get("EVENT_LOOP_LAG_INTERVAL", 0.5))
+
+def route_label(scope) -> str:
+    """请求对应的路由模板：路由匹配时 FastAPI 写入 scope["route"]，路由之前被拒绝的请求由 RateLimitMiddleware 补上"""
+    return getattr(scope.get("route"), "path", "unmatched")
+
+class RequestMetricsMiddleware:
+    """按路由模板记录请求耗时和状态码，未匹配路由统一归为 unmatched 以控制标签数量"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        status = 500
+
+        async def recording_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, recording_send)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            method = scope["method"]
+            route_path = route_label(scope)
+            HTTP_LATENCY.observe(time.perf_counter() - started, method, route_path)
+            HTTP_REQUESTS.inc(method, route_path, str(status))
+            if status >= 500:
+                HTTP_ERRORS.inc(method, route_path)
+
+app.add_middleware(RequestMetricsMiddleware)
+
+async def monitor_event_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + EVENT_LOOP_LAG_INTERVAL
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - expected))
+
+class ProfilingMiddleware:
+    """抽样或按调试请求头开启单请求剖析；未命中时直接透传，不额外包装请求"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if PROFILE_ALLOW_HEADER and Headers(scope=scope).get(PROFILE_HEADER):
+            trigger = "header"
+        elif PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            trigger = "sample"
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], threading.get_ident(), trigger)
+
+        async def profiled_send(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                MutableHeaders(scope=message)["X-Profile-Id"] = profile.id
+            await send(message)
+
+        token = _active_profile.set(profile)
+        started = time.perf_counter()
+        profile.start()
+        try:
+            await self.app(scope, receive, profiled_send)
+        finally:
+            profile.stop()
+            profile.duration = time.perf_counter() - started
+            profile.route = route_label(scope)
+            _active_profile.reset(token)
+            profiles.append(profile)
+
+app.add_middleware(ProfilingMiddleware)
+
+def _get_profile(profile_id: str) -> RequestProfile:
+    for profile in profiles:
+        if profile.id == profile_id:
+            return profile
+    raise HTTPException(status_code=404, detail="剖析记录未找到")
+
+@app.get("/admin/profiles")
+async def list_profiles():
+    """最近的请求剖析记录，新的在前"""
+    return [profile.summary() for profile in reversed(profiles)]
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    """单个请求的阶段耗时和采样分布"""
+    return _get_profile(profile_id).detail()
+
+@app.get("/admin/profiles/{profile_id}/collapsed", response_class=PlainTextResponse)
+async def get_profile_collapsed(profile_id: str):
+    """折叠栈文本，可直接交给 flamegraph.pl 或 speedscope 生成火焰图"""
+    profile = _get_profile(profile_id)
+    return PlainTextResponse(profile.collapsed(), headers={
+        "Content-Disposition": f'attachment; filename="profile-{profile.id}.folded"',
+    })
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 抓取端点"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/health")
 async def health_check():
     return {
@@ -846,6 +2795,16 @@ async def health_check():
         "compositions_count": len(compositions_db)
     }
 
+# CORS 配置
+# 最后注册，位于中间件链最外层，限流返回的 429 / 503 也带上 CORS 头
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # 允许所有来源，生产环境应该配置具体域名
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
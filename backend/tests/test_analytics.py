@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+
+# main 在导入时会加载数据目录，测试使用独立的临时目录
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="contentlego-test-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import main
+
+
+def test_event_segment_round_trip():
+    events = [
+        (1700000000.0, "template_used", "c"),
+        (1700000000.5, "brick_viewed", "a\nb"),
+        (1700000001.25, "template_used", "c"),
+        (1700000002.0, "composition_published", "作品-1"),
+        (1700000003.0, "brick_viewed", ""),
+    ]
+    segment = main.encode_event_segment(
+        [event[0] for event in events],
+        [main.ANALYTICS_EVENT_TYPES.index(event[1]) for event in events],
+        [event[2] for event in events],
+    )
+
+    decoded = list(main.decode_event_segments(segment + segment))
+
+    assert decoded == events + events
+
+
+def test_truncated_tail_segment_is_skipped():
+    segment = main.encode_event_segment([1700000000.0], [0], ["x"])
+
+    assert list(main.decode_event_segments(segment + segment[:-3])) == [(1700000000.0, "brick_viewed", "x")]
+
+
+def test_corrupt_segment_raises():
+    header_size = main.ANALYTICS_SEGMENT_HEADER.size
+    segment = main.encode_event_segment([1700000000.0], [0], ["x"])
+    payload = main.zlib.decompress(segment[header_size:])
+    # 把字典长度改错
+    broken = payload[:-2] + b"yy" + b"z"
+    compressed = main.zlib.compress(broken)
+    data = main.ANALYTICS_SEGMENT_HEADER.pack(main.ANALYTICS_SEGMENT_MAGIC, 1, len(compressed)) + compressed
+
+    with pytest.raises(ValueError):
+        list(main.decode_event_segments(data))
+
+
+def test_segment_after_torn_tail_raises_value_error():
+    first = main.encode_event_segment([1700000000.0], [0], ["x"])
+    second = main.encode_event_segment([1700000001.0], [0], ["y" * 64])
+
+    with pytest.raises(ValueError):
+        list(main.decode_event_segments(first[:-4] + second))
+
+
+def test_append_truncates_torn_tail(tmp_path):
+    path = str(tmp_path / "events.col")
+    first = main.encode_event_segment([1700000000.0], [0], ["x"])
+    second = main.encode_event_segment([1700000001.0], [0], ["y"])
+    with open(path, "wb") as f:
+        f.write(first + second[:-3])
+
+    main.truncate_torn_tail(path)
+    with open(path, "ab") as f:
+        f.write(second)
+
+    with open(path, "rb") as f:
+        decoded = list(main.decode_event_segments(f.read()))
+    assert decoded == [(1700000000.0, "brick_viewed", "x"), (1700000001.0, "brick_viewed", "y")]
@@ -0,0 +1,153 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# main 在导入时会加载数据目录，测试使用独立的临时目录
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="contentlego-test-"))
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import main
+
+LARGE = "正文" * main.BLOB_INLINE_MAX_BYTES
+
+
+def make_brick(brick_id, content):
+    return {
+        "id": brick_id,
+        "type": "text",
+        "title": brick_id,
+        "content": content,
+        "metadata": None,
+        "tags": [],
+        "version": 1,
+        "createdAt": "2024-01-01T00:00:00",
+        "updatedAt": "2024-01-01T00:00:00",
+    }
+
+
+def save(store, collection, bricks):
+    writer = store.writer(collection)
+    saved = [writer.externalize_brick(dict(brick)) for brick in bricks]
+    writer.commit()
+    return saved
+
+
+def make_store(tmp_path):
+    store = main.BlobStore(str(tmp_path / "blobs"), 1024 * 1024)
+    store.deletion_enabled = True
+    return store
+
+
+def run_main(data_dir, code):
+    """在独立进程中按给定数据目录导入 main，返回 code 打印的内容"""
+    env = dict(os.environ, DATA_DIR=str(data_dir))
+    result = subprocess.run(
+        [sys.executable, "-c", f"import main\n{code}"], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, check=True,
+    )
+    return result.stdout.strip().splitlines()[-1]
+
+
+def test_small_bodies_stay_inline(tmp_path):
+    store = make_store(tmp_path)
+
+    saved = save(store, "bricks", [make_brick("a", "短正文"), make_brick("b", LARGE)])
+
+    assert saved[0]["content"] == "短正文" and "contentHash" not in saved[0]
+    assert "content" not in saved[1]
+    assert store.exists(saved[1]["contentHash"])
+
+
+def test_shared_body_survives_until_last_collection_drops_it(tmp_path):
+    store = make_store(tmp_path)
+    blob_hash = save(store, "bricks", [make_brick("a", LARGE)])[0]["contentHash"]
+    save(store, "templates", [make_brick("a", LARGE)])
+
+    save(store, "bricks", [])
+    assert store.exists(blob_hash)
+
+    save(store, "templates", [])
+    assert not store.exists(blob_hash)
+
+
+def test_update_dropping_last_reference_deletes_blob(tmp_path):
+    store = make_store(tmp_path)
+    old_hash = save(store, "bricks", [make_brick("a", LARGE)])[0]["contentHash"]
+    store.read(old_hash)
+
+    new_hash = save(store, "bricks", [make_brick("a", LARGE + "!")])[0]["contentHash"]
+
+    assert store.exists(new_hash)
+    assert not store.exists(old_hash)
+    assert old_hash not in store.cache and store.cached_bytes == 0
+
+
+def test_deletion_disabled_keeps_orphans(tmp_path):
+    store = make_store(tmp_path)
+    store.deletion_enabled = False
+    blob_hash = save(store, "bricks", [make_brick("a", LARGE)])[0]["contentHash"]
+
+    save(store, "bricks", [])
+
+    assert store.exists(blob_hash)
+
+
+def test_cache_counts_utf8_bytes(tmp_path):
+    store = make_store(tmp_path)
+    store.cache_bytes = len(LARGE.encode("utf-8")) + 10
+    hashes = [save(store, name, [make_brick("a", LARGE + name)])[0]["contentHash"] for name in ("x", "y")]
+
+    for blob_hash in hashes:
+        store.read(blob_hash)
+
+    assert list(store.cache) == [hashes[1]]
+    assert store.cached_bytes == len((LARGE + "y").encode("utf-8"))
+
+
+def test_failed_load_keeps_deletion_off(tmp_path):
+    run_main(tmp_path, "print(1)")
+    with open(tmp_path / "bricks.json", encoding="utf-8") as f:
+        bricks = json.load(f)
+    bricks["shared"] = make_brick("shared", LARGE)
+    with open(tmp_path / "bricks.json", "w", encoding="utf-8") as f:
+        json.dump(bricks, f)
+    with open(tmp_path / "templates.json", "w", encoding="utf-8") as f:
+        json.dump({"t": {
+            "id": "t", "name": "t", "description": "", "bricks": [make_brick("shared", LARGE)],
+            "category": "c", "isPublic": True, "variables": [], "tags": [], "usageCount": 0, "rating": 0.0,
+            "createdBy": "u", "createdAt": "2024-01-01T00:00:00", "updatedAt": "2024-01-01T00:00:00",
+        }}, f)
+    # 迁移后正文只存一份，模板和积木都引用它
+    run_main(tmp_path, "print(1)")
+    blob_hash = main.content_hash(LARGE)
+    blob_path = tmp_path / "blobs" / blob_hash[:2] / blob_hash[2:]
+    assert blob_path.exists()
+
+    # 模板集合加载失败：其引用不在内存中，删除积木后也不能删掉模板引用的正文
+    with open(tmp_path / "templates.json", "a", encoding="utf-8") as f:
+        f.write("broken")
+    output = run_main(
+        tmp_path,
+        "del main.bricks_db['shared']\nmain.save_bricks_to_file()\nprint(main.blob_store.deletion_enabled)",
+    )
+
+    assert output == "False"
+    assert blob_path.exists()
+
+
+def test_old_inline_format_is_migrated(tmp_path):
+    with open(tmp_path / "bricks.json", "w", encoding="utf-8") as f:
+        json.dump({"large": make_brick("large", LARGE), "small": make_brick("small", "短正文")}, f)
+
+    output = run_main(tmp_path, "print(main.bricks_db['large'].content == %r)" % LARGE)
+
+    assert output == "True"
+    with open(tmp_path / "bricks.json", encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["large"]["contentHash"] == main.content_hash(LARGE) and "content" not in saved["large"]
+    assert saved["small"]["content"] == "短正文"
+    blob_hash = saved["large"]["contentHash"]
+    assert (tmp_path / "blobs" / blob_hash[:2] / blob_hash[2:]).exists()
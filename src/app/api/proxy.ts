@@ -0,0 +1,12 @@
+import { NextRequest } from 'next/server'
+
+// 代理到后端的请求连接地址都是 Next 服务器，浏览器地址通过 X-Forwarded-For 转给后端限流使用
+// （后端需设置 RATE_LIMIT_TRUST_PROXY=1，且只取最右一项，即这里追加的地址）。
+// 浏览器自带的 X-Forwarded-For 可以伪造，只保留在左侧；拿不到连接地址时不转发，避免后端把伪造值当成客户端
+export function forwardHeaders(request: NextRequest): Record<string, string> {
+  if (!request.ip) {
+    return {}
+  }
+  const incoming = request.headers.get('x-forwarded-for')
+  return { 'X-Forwarded-For': incoming ? `${incoming}, ${request.ip}` : request.ip }
+}
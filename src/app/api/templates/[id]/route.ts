@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server'
+import { forwardHeaders } from '@/app/api/proxy'
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'
 
@@ -7,7 +8,9 @@ export async function GET(
   { params }: { params: { id: string } }
 ) {
   try {
-    const response = await fetch(`${API_BASE_URL}/templates/${params.id}`)
+    const response = await fetch(`${API_BASE_URL}/templates/${params.id}`, {
+      headers: forwardHeaders(request),
+    })
     if (!response.ok) {
       throw new Error('Failed to fetch template')
     }
@@ -32,6 +35,7 @@ export async function PUT(
       method: 'PUT',
       headers: {
         'Content-Type': 'application/json',
+        ...forwardHeaders(request),
       },
       body: JSON.stringify(body),
     })
@@ -58,6 +62,7 @@ export async function DELETE(
   try {
     const response = await fetch(`${API_BASE_URL}/templates/${params.id}`, {
       method: 'DELETE',
+      headers: forwardHeaders(request),
     })
     
     if (!response.ok) {
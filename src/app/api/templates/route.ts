@@ -1,10 +1,13 @@
 import { NextRequest, NextResponse } from 'next/server'
+import { forwardHeaders } from '@/app/api/proxy'
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'
 
-export async function GET() {
+export async function GET(request: NextRequest) {
   try {
-    const response = await fetch(`${API_BASE_URL}/templates`)
+    const response = await fetch(`${API_BASE_URL}/templates`, {
+      headers: forwardHeaders(request),
+    })
     if (!response.ok) {
       throw new Error('Failed to fetch templates')
     }
@@ -26,6 +29,7 @@ export async function POST(request: NextRequest) {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        ...forwardHeaders(request),
       },
       body: JSON.stringify(body),
     })
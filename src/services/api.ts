@@ -1,5 +1,5 @@
 import axios from 'axios';
-import { ContentBrick, ContentTemplate, ContentComposition, AIGenerateRequest, AIGenerateResponse } from '@/types';
+import { ContentBrick, ContentTemplate, ContentComposition, AIGenerateRequest, AIGenerateResponse, FacetCounts, MediaAsset, AnalyticsEvent, AnalyticsSummary } from '@/types';
 
 // API 基础配置
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
@@ -77,6 +77,12 @@ export const bricksApi = {
   deleteBrick: async (id: string): Promise<void> => {
     await api.delete(`/bricks/${id}`);
   },
+
+  // 获取类型、标签计数
+  getFacets: async (params?: { search?: string }): Promise<FacetCounts> => {
+    const response = await api.get('/bricks/facets', { params });
+    return response.data;
+  },
 };
 
 // 模板相关 API
@@ -109,6 +115,12 @@ export const templatesApi = {
   deleteTemplate: async (id: string): Promise<void> => {
     await api.delete(`/templates/${id}`);
   },
+
+  // 获取分类、标签、积木类型计数
+  getFacets: async (params?: { search?: string }): Promise<FacetCounts> => {
+    const response = await api.get('/templates/facets', { params });
+    return response.data;
+  },
 };
 
 // AI 相关 API
@@ -164,6 +176,34 @@ export const compositionsApi = {
   },
 };
 
+// 素材相关 API
+export const mediaApi = {
+  // 上传素材，返回的 url 可填入积木的 metadata.imageUrl
+  uploadMedia: async (file: File): Promise<MediaAsset> => {
+    const formData = new FormData();
+    formData.append('file', file);
+    const response = await api.post('/media', formData, {
+      headers: { 'Content-Type': 'multipart/form-data' },
+      timeout: 0,
+    });
+    return response.data;
+  },
+
+  // 获取素材列表
+  getMediaList: async (): Promise<MediaAsset[]> => {
+    const response = await api.get('/media');
+    return response.data;
+  },
+
+  // 素材的完整访问地址
+  getMediaUrl: (asset: MediaAsset): string => `${API_BASE_URL}${asset.url}`,
+
+  // 删除素材
+  deleteMedia: async (id: string): Promise<void> => {
+    await api.delete(`/media/${id}`);
+  },
+};
+
 // 渠道管理相关 API
 export const channelsApi = {
   // 获取渠道列表
@@ -216,6 +256,21 @@ export const channelsApi = {
   },
 };
 
+// 数据分析相关 API
+export const analyticsApi = {
+  // 批量上报事件
+  trackEvents: async (events: AnalyticsEvent[]): Promise<{ accepted: number; dropped: number }> => {
+    const response = await api.post('/analytics/events', { events });
+    return response.data;
+  },
+
+  // 获取汇总数据
+  getSummary: async (params?: { window?: 'hour' | 'day' | 'week'; limit?: number }): Promise<AnalyticsSummary> => {
+    const response = await api.get('/analytics/summary', { params });
+    return response.data;
+  },
+};
+
 export const healthApi = {
   check: async (): Promise<{ status: string; timestamp: string; bricks_count: number; templates_count: number; compositions_count: number }> => {
     const response = await api.get('/health');
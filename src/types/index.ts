@@ -44,6 +44,44 @@ export interface ContentComposition {
   updatedAt: string;
 }
 
+// 上传的积木素材（图片、视频等）
+export interface MediaAsset {
+  id: string;
+  filename: string;
+  contentType: string;
+  size: number;
+  url: string;
+  createdAt: string;
+}
+
+// 分析事件
+export type AnalyticsEventType = 'brick_viewed' | 'template_used' | 'composition_published';
+
+export interface AnalyticsEvent {
+  type: AnalyticsEventType;
+  entityId: string;
+  timestamp?: string;
+}
+
+// 分析汇总（最近一小时 / 一天 / 一周）
+export interface AnalyticsSummary {
+  window: 'hour' | 'day' | 'week';
+  from: string;
+  to: string;
+  bucketSeconds: number;
+  totals: Record<AnalyticsEventType, number>;
+  series: { start: string; counts: Record<AnalyticsEventType, number> }[];
+  top: Record<AnalyticsEventType, { entityId: string; count: number }[]>;
+}
+
+// 分面计数（取值 -> 数量，按数量降序）
+export interface FacetCounts {
+  total: number;
+  type: Record<string, number>;
+  tag: Record<string, number>;
+  category?: Record<string, number>;
+}
+
 // 构建器状态类型
 export interface BuilderState {
   selectedBricks: ContentBrick[];